@@ -1,16 +1,18 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import time
 import random
-from datetime import datetime, timedelta
-from fpdf import FPDF
-import base64
-import os
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
+from datetime import datetime
+from pandero import (
+    TAB_USUARIOS, COLS_USUARIOS, TAB_GRUPOS, COLS_GRUPOS, TAB_MIEMBROS, COLS_MIEMBROS, TAB_PAGOS, COLS_PAGOS,
+    cargar_df, cargar_todo, agregar_df, actualizar_df, buscar_df, errores_datos,
+    almacen, AlmacenSheets, copiar_almacen, registrar_usuario, inscribir_miembro,
+    nuevo_id_pago, cambiar_estado_pagos, enviar_voucher, estado_subida, html_miniatura, FOTO_SUBIENDO, FOTO_ERROR,
+    generar_calendario_usuario, tabla_calendario, miembros_grupo, reporte_grupo, resumen_grupos, pdf_grupo, zip_reportes, nombre_archivo,
+    ruta_archivo, archivables, archivar_grupos, grupos_archivados, historial_grupo, leer_archivo,
+    COLS_IMPORTAR, leer_planilla, validar_pagos, validar_socios, importar_filas,
+    estado_escritura, inicio_rerun, fin_rerun, contadores, resumen_tramos, reruns_lentos, exportar_metricas, reiniciar_metricas,
+)
 
 # --- CONFIGURACIÓN GENERAL ---
 st.set_page_config(page_title="Sistema Pandero", page_icon="💰", layout="wide")
@@ -28,139 +30,21 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# --- CONEXIÓN CLOUDINARY ---
-def init_cloudinary():
-    try:
-        cloudinary.config(
-            cloud_name = st.secrets["cloudinary"]["cloud_name"],
-            api_key = st.secrets["cloudinary"]["api_key"],
-            api_secret = st.secrets["cloudinary"]["api_secret"],
-            secure = True
-        )
-    except: pass
-init_cloudinary()
-
-# --- CONEXIÓN GOOGLE SHEETS ---
-def conectar_db(hoja_nombre):
-    try:
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        creds_dict = dict(st.secrets["gcp_service_account"])
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        sh = client.open("BASE_DATOS_PANDERO") 
-        return sh.worksheet(hoja_nombre)
-    except Exception as e:
-        st.error(f"⚠️ Error de conexión (Espera 1 min): {e}")
-        st.stop()
-
-# --- CARGA CON CACHÉ ---
-@st.cache_data(ttl=60, show_spinner=False)
-def cargar_df(hoja, columnas_obligatorias):
-    try:
-        ws = conectar_db(hoja)
-        data = ws.get_all_records()
-    except: return pd.DataFrame(columns=columnas_obligatorias)
-
-    if not data:
-        try: 
-            headers = ws.row_values(1)
-            if not headers: ws.append_row(columnas_obligatorias)
-        except: pass
-        return pd.DataFrame(columns=columnas_obligatorias)
-    
-    df = pd.DataFrame(data).astype(str)
-    for col in columnas_obligatorias:
-        if col not in df.columns: df[col] = "" 
-    return df
-
-def guardar_df_completo(hoja, df):
-    try:
-        ws = conectar_db(hoja); ws.clear()
-        ws.update([df.columns.values.tolist()] + df.values.tolist())
-        st.cache_data.clear()
-    except Exception as e: st.error(f"Error guardando: {e}")
-
-# --- VARIABLES ---
-TAB_USUARIOS = 'usuarios'; COLS_USUARIOS = ["Nombre", "DNI", "Celular"]
-TAB_GRUPOS = 'grupos'; COLS_GRUPOS = ["NombreGrupo", "FechaInicio", "SemanasDuracion", "MontoBase", "MontoInteres"]
-TAB_MIEMBROS = 'miembros'; COLS_MIEMBROS = ["NombreGrupo", "DNI_Usuario", "Turno", "Tipo"]
-TAB_PAGOS = 'pagos'; COLS_PAGOS = ["Fecha", "DNI", "Grupo", "Monto", "Estado", "Foto", "SemanaPagada"]
-
-def limpiar_fecha(fecha_str): return str(fecha_str).split(" ")[0]
-
-# --- PDF ---
-def crear_reporte_pdf(nombre_grupo, datos_miembros):
-    class PDF(FPDF):
-        def header(self):
-            self.set_font('Arial', 'B', 15); self.cell(0, 10, f'Reporte: {nombre_grupo}', 0, 1, 'C'); self.ln(5)
-    pdf = PDF(); pdf.add_page(); pdf.set_font("Arial", size=10); pdf.set_fill_color(200, 220, 255)
-    pdf.cell(80, 10, "Socio", 1, 0, 'C', 1); pdf.cell(20, 10, "Turno", 1, 0, 'C', 1)
-    pdf.cell(30, 10, "Pagado", 1, 0, 'C', 1); pdf.cell(30, 10, "Deuda", 1, 0, 'C', 1); pdf.cell(30, 10, "Estado", 1, 1, 'C', 1)
-    for m in datos_miembros:
-        pdf.cell(80, 10, str(m['Nombre']), 1); pdf.cell(20, 10, str(m['Turno']), 1, 0, 'C')
-        pdf.cell(30, 10, f"S/. {m['Pagado']}", 1, 0, 'R'); pdf.cell(30, 10, str(m['Deuda']), 1, 0, 'C')
-        pdf.set_text_color(255, 0, 0) if m['Deuda'] > 0 else pdf.set_text_color(0, 128, 0)
-        pdf.cell(30, 10, "DEUDA" if m['Deuda'] > 0 else "OK", 1, 1, 'C'); pdf.set_text_color(0)
-    return pdf.output(dest='S').encode('latin-1')
-
-# --- CÁLCULOS MODIFICADOS PARA SOPORTAR GRUPO ESPECÍFICO ---
-def generar_calendario_usuario(dni_usuario, nombre_grupo_objetivo=None):
-    df_m = cargar_df(TAB_MIEMBROS, COLS_MIEMBROS); df_g = cargar_df(TAB_GRUPOS, COLS_GRUPOS); df_p = cargar_df(TAB_PAGOS, COLS_PAGOS)
-    
-    if df_m.empty: return [], "Sin Grupo", "Completo"
-    df_m['DNI_Usuario'] = df_m['DNI_Usuario'].astype(str); dni_usuario = str(dni_usuario)
-    
-    # FILTRO: Buscar todos los grupos del usuario o uno específico
-    mis_filas = df_m[df_m['DNI_Usuario'] == dni_usuario]
-    if mis_filas.empty: return [], "Sin Grupo", "Completo"
-    
-    # Si no nos dan un grupo objetivo, tomamos el primero (comportamiento default)
-    # Si nos dan uno, filtramos por ese
-    if nombre_grupo_objetivo:
-        fila_target = mis_filas[mis_filas['NombreGrupo'] == nombre_grupo_objetivo]
-        if fila_target.empty: return [], "No inscrito en este grupo", "Completo"
-        dat_m = fila_target.iloc[0]
-    else:
-        dat_m = mis_filas.iloc[0] # Fallback al primero
-    
-    grupo = dat_m['NombreGrupo']
-    try: turno = int(float(dat_m.get('Turno', 0)))
-    except: turno = 0
-    tipo_p = dat_m.get('Tipo', 'Completo'); factor = 0.5 if tipo_p == 'Medio' else 1.0
-    
-    # Datos del Grupo
-    g_idx = df_g[df_g['NombreGrupo'] == grupo]
-    if g_idx.empty: return [], "Grupo Eliminado", "Completo"
-    
-    dat_g = g_idx.iloc[0]
-    inicio = datetime.strptime(limpiar_fecha(dat_g['FechaInicio']), "%Y-%m-%d")
-    duracion = int(float(dat_g['SemanasDuracion']))
-    base = float(dat_g.get('MontoBase', 400)) * factor; interes = float(dat_g.get('MontoInteres', 430)) * factor
-    
-    mis_pagos = df_p[(df_p['DNI'] == dni_usuario) & (df_p['Grupo'] == grupo)] if not df_p.empty else pd.DataFrame()
-    tot_pagado = 0; tot_pendiente = 0
-    if not mis_pagos.empty:
-        try: tot_pagado = mis_pagos[mis_pagos['Estado'] == 'Aprobado']['Monto'].astype(float).sum()
-        except: pass
-        try: tot_pendiente = mis_pagos[mis_pagos['Estado'] == 'Pendiente']['Monto'].astype(float).sum()
-        except: pass
-        
-    cal = []; hoy = datetime.now(); acumulado = 0
-    for i in range(duracion):
-        num = i + 1; fecha = inicio + timedelta(weeks=i)
-        monto = interes if (turno > 0 and num > turno) else base
-        acumulado += monto
-        estado = "grey"
-        if tot_pagado >= acumulado: estado = "green"
-        elif (tot_pagado + tot_pendiente) >= acumulado: estado = "orange"
-        elif tot_pagado >= (acumulado - monto) and tot_pagado < acumulado: estado = "yellow"
-        elif fecha < hoy: estado = "red"
-        cal.append({"Semana": num, "Fecha": fecha.strftime("%d/%m"), "Monto": monto, "Estado": estado})
-    return cal, grupo, tipo_p
-
 # --- ESTADOS ---
 if 'usuario' not in st.session_state: st.session_state.usuario = None
 if 'login_step' not in st.session_state: st.session_state.login_step = 'dni'
+inicio_rerun(st.session_state.get('grupo_sel') or st.session_state.get('rol') if st.session_state.usuario else 'login')  # página, para el resumen de tiempos
+
+def estado_guardado():
+    # Cambios de esta sesión que siguen en la cola de escritura de Google Sheets
+    ids = st.session_state.get('escrituras', []); estados = {i: estado_escritura(i) for i in ids}
+    pend = [i for i, e in estados.items() if e and e['estado'] in ('en_cola', 'escribiendo')]
+    fallidas = st.session_state.setdefault('escrituras_fallidas', [])
+    fallidas += [e for e in estados.values() if e and e['estado'] == 'error']
+    st.session_state.escrituras = pend
+    if pend: st.info(f"⏳ Guardando {len(pend)} cambio(s)...")
+    for e in fallidas: st.error(f"⚠️ No se pudo guardar un cambio en '{e['hoja']}': {e['error']}")
+    if fallidas: st.button("Entendido", on_click=lambda: st.session_state.escrituras_fallidas.clear())
 
 with st.sidebar:
     st.title("🏛️ PANDERO")
@@ -168,6 +52,7 @@ with st.sidebar:
         st.success(f"Hola, {st.session_state.nombre_pila}")
         if st.button("Cerrar Sesión"):
             st.session_state.usuario = None; st.session_state.login_step = 'dni'; st.rerun()
+    if st.session_state.get('escrituras') or st.session_state.get('escrituras_fallidas'): st.fragment(run_every=2)(estado_guardado)()
 
 # 1. LOGIN UNIFICADO
 if st.session_state.usuario is None:
@@ -180,11 +65,10 @@ if st.session_state.usuario is None:
                 new_nombre = st.text_input("Nombre Completo"); new_dni = st.text_input("DNI (Usuario)"); new_cel = st.text_input("Celular")
                 if st.form_submit_button("Registrarme Ahora", type="primary", use_container_width=True):
                     if new_nombre and new_dni:
-                        df_u = cargar_df(TAB_USUARIOS, COLS_USUARIOS)
-                        if new_dni in df_u['DNI'].values: st.error("DNI ya registrado.")
-                        else:
-                            nuevo = pd.DataFrame([{"Nombre": new_nombre, "DNI": new_dni, "Celular": new_cel}])
-                            guardar_df_completo(TAB_USUARIOS, pd.concat([df_u, nuevo], ignore_index=True))
+                        try: creado = registrar_usuario(new_nombre, new_dni, new_cel)
+                        except Exception as e: creado = None; st.error(f"Error guardando: {e}")
+                        if creado is False: st.error("DNI ya registrado.")
+                        elif creado:
                             st.success("¡Cuenta creada!"); time.sleep(2); st.session_state.login_step = 'dni'; st.rerun()
                     else: st.warning("Faltan datos")
             if st.button("⬅️ Volver"): st.session_state.login_step = 'dni'; st.rerun()
@@ -202,10 +86,10 @@ if st.session_state.usuario is None:
             if st.button("Continuar", type="primary", use_container_width=True):
                 if dni_input.strip().upper() == "ADMIN": st.session_state.login_step = 'password'; st.rerun()
                 else:
-                    df_u = cargar_df(TAB_USUARIOS, COLS_USUARIOS)
-                    if not df_u.empty and str(dni_input) in df_u['DNI'].values:
+                    df_u = buscar_df(TAB_USUARIOS, COLS_USUARIOS, DNI=str(dni_input))
+                    if not df_u.empty:
                         st.session_state.usuario = str(dni_input); st.session_state.rol = 'usuario'
-                        st.session_state.nombre_pila = df_u[df_u['DNI']==str(dni_input)].iloc[0]['Nombre']; st.rerun()
+                        st.session_state.nombre_pila = df_u.iloc[0]['Nombre']; st.rerun()
                     else: st.error("DNI no encontrado.")
             st.markdown(" "); st.markdown("<p style='text-align: center;'>¿Nuevo?</p>", unsafe_allow_html=True)
             if st.button("Crear Cuenta", use_container_width=True): st.session_state.login_step = 'registro'; st.rerun()
@@ -215,6 +99,28 @@ elif st.session_state.rol == 'admin':
     if 'grupo_sel' not in st.session_state: st.session_state.grupo_sel = None
     if not st.session_state.grupo_sel:
         st.header("Panel de Control")
+        if st.query_params.get("perf") == "1":  # oculto: sólo se ve entrando con ?perf=1
+            with st.expander("⏱️ Rendimiento", expanded=True):
+                cont = contadores(); hits = cont.get('cache_hit', 0); total = hits + cont.get('cache_miss', 0)
+                c1, c2, c3, c4 = st.columns(4)
+                c1.metric("Llamadas a Sheets", cont.get('sheets_api', 0)); c2.metric("Errores 429", cont.get('sheets_429', 0))
+                c3.metric("Aciertos de caché", f"{hits / total:.0%}" if total else "-")
+                c4.metric("Subidas (ok / error)", f"{cont.get('subidas_ok', 0)} / {cont.get('subidas_error', 0)}")
+                st.write("Tramos"); st.dataframe(resumen_tramos(), use_container_width=True)
+                lentos = reruns_lentos()
+                if lentos:
+                    st.write("Ejecuciones más lentas")
+                    st.dataframe(pd.DataFrame([{"Hora": datetime.fromtimestamp(r['ts']).strftime("%H:%M:%S"), "Página": r['pagina'],
+                                                "Total (ms)": r['total_ms'], "Completa": r['completo'],
+                                                "Tramos": ", ".join(f"{k} {v['ms']:.0f}ms" for k, v in sorted(r['tramos'].items(), key=lambda x: -x[1]['ms']))}
+                                               for r in lentos]), hide_index=True, use_container_width=True)
+                c1, c2 = st.columns(2)
+                c1.download_button("⬇️ Descargar logs (JSONL)", exportar_metricas(), "pandero_perf.jsonl", "application/x-ndjson")
+                if c2.button("Reiniciar métricas"): reiniciar_metricas(); st.rerun()
+        cargar_todo(); errores = errores_datos()
+        if errores:
+            with st.expander(f"⚠️ {len(errores)} celda(s) con formato inválido en la base"):
+                st.dataframe(pd.DataFrame(errores), hide_index=True, use_container_width=True)
         with st.expander("➕ Crear Nuevo Grupo"):
             c1, c2 = st.columns(2)
             n_nuevo = c1.text_input("Nombre Grupo"); f_nuevo = c2.date_input("Fecha Inicio")
@@ -225,59 +131,79 @@ elif st.session_state.rol == 'admin':
                 if not df_g.empty and n_nuevo in df_g['NombreGrupo'].values: st.error("Existe")
                 else:
                     new = pd.DataFrame([{"NombreGrupo":n_nuevo, "FechaInicio":str(f_nuevo), "SemanasDuracion":d, "MontoBase":mb, "MontoInteres":mi}])
-                    guardar_df_completo(TAB_GRUPOS, pd.concat([df_g, new], ignore_index=True)); st.success("Hecho"); st.rerun()
+                    agregar_df(TAB_GRUPOS, new); st.success("Hecho"); st.rerun()
         df_g = cargar_df(TAB_GRUPOS, COLS_GRUPOS)
         if not df_g.empty:
+            st.download_button("📦 Reportes de todos los grupos (ZIP)", data=lambda: zip_reportes(cargar_todo()),
+                               file_name=f"Reportes_{datetime.now():%Y-%m-%d}.zip", mime="application/zip", on_click="ignore")
+            res_g, res_s = resumen_grupos()
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Recaudado", f"S/. {res_g['Recaudado'].sum():,.2f}"); c2.metric("Por validar", f"S/. {res_g['Pendiente'].sum():,.2f}")
+            c3.metric("Socios con deuda", int(res_g['Con deuda'].sum()))
+            st.dataframe(res_g, hide_index=True, use_container_width=True)
+            deudores = res_s[res_s['Deuda'] > 0] if not res_s.empty else res_s
+            if not deudores.empty:
+                with st.expander(f"🔴 {len(deudores)} socio(s) con semanas vencidas"):
+                    st.dataframe(deudores.sort_values('Deuda', ascending=False), hide_index=True, use_container_width=True)
             cols = st.columns(3)
             for i, r in df_g.iterrows():
                 with cols[i%3]:
                     st.info(f"📁 {r['NombreGrupo']}")
                     if st.button(f"Entrar {r['NombreGrupo']}"): st.session_state.grupo_sel = r['NombreGrupo']; st.rerun()
         else: st.info("No hay grupos.")
+        with st.expander("🗄️ Grupos terminados (archivo)"):
+            if not ruta_archivo(): st.info("Para archivar, configura una carpeta persistente en secrets: [almacen] archivo = \"/ruta\"")
+            else:
+                listos = archivables(cargar_todo())
+                if listos:
+                    st.write(f"Listos para archivar: {', '.join(listos)}")
+                    if st.button(f"Archivar {len(listos)} grupo(s)"):
+                        try: st.success(f"Archivado: {archivar_grupos(listos)}"); st.rerun()
+                        except Exception as e: st.error(f"No se archivó nada: {e}")
+                else: st.caption("No hay grupos terminados y saldados (sin deudas ni pagos por validar).")
+                archivados = grupos_archivados()
+                if archivados:
+                    sel_a, ini_a = st.selectbox("Ver grupo archivado", archivados, format_func=lambda x: f"{x[0]} (inicio {x[1]})")
+                    hist = historial_grupo(sel_a, ini_a)
+                    st.dataframe(pd.DataFrame(reporte_grupo(sel_a, hist)), hide_index=True, use_container_width=True)
+                    st.download_button("📄 PDF del grupo archivado", data=lambda: pdf_grupo(sel_a, hist),
+                                       file_name=f"Reporte_{nombre_archivo(sel_a)}_{ini_a}.pdf", mime="application/pdf", on_click="ignore")
     else:
         grupo = st.session_state.grupo_sel
         if st.button("⬅️ Volver"): st.session_state.grupo_sel = None; st.rerun()
         st.title(f"Gestión: {grupo}")
-        t1, t2, t3, t4, t5, t6 = st.tabs(["Miembros", "Inscribir", "Sorteo", "Ajustes", "Pagos", "Reportes"])
+        datos = cargar_todo()
+        t1, t2, t3, t4, t5, t6, t7 = st.tabs(["Miembros", "Inscribir", "Sorteo", "Ajustes", "Pagos", "Reportes", "Importar"])
         with t1:
-            df_m = cargar_df(TAB_MIEMBROS, COLS_MIEMBROS); df_u = cargar_df(TAB_USUARIOS, COLS_USUARIOS)
-            mis_m = df_m[df_m['NombreGrupo']==grupo]
-            if not mis_m.empty:
-                mis_m['TurnoNum'] = pd.to_numeric(mis_m['Turno'], errors='coerce').fillna(0)
-                mis_m = mis_m.sort_values(by='TurnoNum')
-                dat = pd.merge(mis_m, df_u, left_on="DNI_Usuario", right_on="DNI")
-                for _, r in dat.iterrows():
-                    cal, _, _ = generar_calendario_usuario(r['DNI'], grupo) # <-- Pasamos el grupo explícito
-                    deuda = sum(1 for c in cal if c['Estado']=='red')
+            socios, res_g = miembros_grupo(grupo, datos) # <-- una pasada para todo el grupo
+            if socios:
+                for r, cal_m in socios:
+                    deuda = res_g.at[r['DNI'], 'Deuda']
                     tag = '½' if r['Tipo']=='Medio' else ''
                     with st.expander(f"T{r['Turno']} | {'🔴' if deuda>0 else '🟢'} {r['Nombre']} {tag}"):
                         c1, c2 = st.columns([3,1])
                         c1.write(f"DNI: {r['DNI']} | Deuda: {deuda}"); c1.markdown(f"[📲 WhatsApp](https://wa.me/?text=Hola%20{r['Nombre']})")
-                        c2.metric("Pagado", f"S/. {sum(c['Monto'] for c in cal if c['Estado']=='green')}")
-                        dfv = pd.DataFrame(cal)[['Semana','Fecha','Monto','Estado']]
-                        dfv['Monto'] = dfv['Monto'].apply(lambda x: f"S/. {x:.2f}")
-                        dfv['Estado'] = dfv['Estado'].map({'red':'🔴','green':'🟢','grey':'⚪','orange':'🟠','yellow':'🟡'})
-                        st.dataframe(dfv, hide_index=True, use_container_width=True)
+                        c2.metric("Pagado", f"S/. {res_g.at[r['DNI'], 'Pagado']}")
+                        st.dataframe(tabla_calendario(cal_m), hide_index=True, use_container_width=True)
             else: st.info("Sin miembros")
         with t2:
             st.write("Inscribir Socio")
             busq = st.text_input("Buscar DNI/Nombre")
-            df_u = cargar_df(TAB_USUARIOS, COLS_USUARIOS)
+            df_u = datos[TAB_USUARIOS]
             if not df_u.empty:
                 filtro = df_u[df_u['Nombre'].str.contains(busq, case=False)|df_u['DNI'].astype(str).str.contains(busq)] if busq else df_u
                 sel = st.selectbox("Seleccionar", filtro['DNI'] + " - " + filtro['Nombre'])
                 c1, c2 = st.columns(2)
-                df_g_curr = cargar_df(TAB_GRUPOS, COLS_GRUPOS)
-                dur = int(float(df_g_curr[df_g_curr['NombreGrupo']==grupo].iloc[0]['SemanasDuracion']))
+                df_g_curr = datos[TAB_GRUPOS]
+                dur = df_g_curr[df_g_curr['NombreGrupo']==grupo].iloc[0]['SemanasDuracion']
+                dur = int(dur) if pd.notna(dur) else 1
                 turn = c1.number_input("Turno", 1, dur); medio = c2.checkbox("Medio Turno")
                 if st.button("Inscribir"):
                     dni = sel.split(" - ")[0]
-                    df_mm = cargar_df(TAB_MIEMBROS, COLS_MIEMBROS)
-                    if df_mm[(df_mm['NombreGrupo']==grupo)&(df_mm['DNI_Usuario']==dni)].empty:
-                        new = pd.DataFrame([{"NombreGrupo":grupo, "DNI_Usuario":dni, "Turno":turn, "Tipo":'Medio' if medio else 'Completo'}])
-                        guardar_df_completo(TAB_MIEMBROS, pd.concat([df_mm, new], ignore_index=True))
-                        st.success("Inscrito"); st.rerun()
-                    else: st.error("Ya está")
+                    try: inscrito = inscribir_miembro(grupo, dni, turn, 'Medio' if medio else 'Completo')
+                    except Exception as e: inscrito = None; st.error(f"Error guardando: {e}")
+                    if inscrito: st.success("Inscrito"); st.rerun()
+                    elif inscrito is False: st.error("Ya está")
         with t3:
             if st.button("🎲 Sortear Turnos"):
                 df_mm = cargar_df(TAB_MIEMBROS, COLS_MIEMBROS)
@@ -285,31 +211,46 @@ elif st.session_state.rol == 'admin':
                 if idxs:
                     ts = list(range(1, len(idxs)+1)); random.shuffle(ts)
                     for i, x in enumerate(idxs): df_mm.at[x, 'Turno'] = ts[i]
-                    guardar_df_completo(TAB_MIEMBROS, df_mm); st.success("Listo!"); st.balloons()
-        with t4: st.info("Edita en Google Sheets")
+                    actualizar_df(TAB_MIEMBROS, df_mm, idxs, ['Turno']); st.success("Listo!"); st.balloons()
+        with t4:
+            alm = almacen()
+            if alm.nombre == "SQLite":
+                st.info(f"Base local SQLite: {alm.ruta}")
+                c1, c2 = st.columns(2)
+                if c1.button("⬇️ Importar desde Google Sheets"):
+                    st.success(f"Importado: {copiar_almacen(AlmacenSheets(), alm)}")
+                if c2.button("⬆️ Exportar a Google Sheets"):
+                    st.success(f"Exportado: {copiar_almacen(alm, AlmacenSheets())}")
+            else: st.info("Edita en Google Sheets")
         with t5:
             st.subheader("Validación")
             t_rev, t_man = st.tabs(["Con Foto", "Manual"])
-            df_p = cargar_df(TAB_PAGOS, COLS_PAGOS); df_u = cargar_df(TAB_USUARIOS, COLS_USUARIOS)
+            df_u = datos[TAB_USUARIOS]
             with t_rev:
-                pend = df_p[(df_p['Grupo']==grupo)&(df_p['Estado']=='Pendiente')]
+                pend = buscar_df(TAB_PAGOS, COLS_PAGOS, Grupo=grupo, Estado='Pendiente')
                 if not pend.empty:
                     view = pd.merge(pend, df_u, on="DNI")
-                    for idx, r in view.iterrows():
+                    marcados = []
+                    for _, r in view.iterrows():
                         with st.container(border=True):
                             c1, c2 = st.columns(2)
                             c1.write(f"**{r['Nombre']}** | {r.get('SemanaPagada')}")
                             c1.write(f"Monto: S/. {r['Monto']}")
-                            if str(r['Foto']).startswith('http'): c1.image(r['Foto'], use_container_width=True)
+                            if str(r['Foto']).startswith('http'):
+                                c1.markdown(html_miniatura(r['Foto']), unsafe_allow_html=True); c1.caption("Toca la foto para verla completa")
+                            elif r['Foto'] == FOTO_SUBIENDO: c1.info("⏳ Subiendo foto...")
+                            elif r['Foto'] == FOTO_ERROR: c1.error("No se pudo subir la foto")
                             else: c1.warning("Foto local")
-                            if c2.button("✅", key=f"y{idx}"):
-                                mask = (df_p['DNI']==r['DNI'])&(df_p['Fecha']==r['Fecha'])&(df_p['Monto']==r['Monto'])
-                                df_p.at[df_p[mask].index[0], 'Estado']='Aprobado'
-                                guardar_df_completo(TAB_PAGOS, df_p); st.rerun()
-                            if c2.button("❌", key=f"n{idx}"):
-                                mask = (df_p['DNI']==r['DNI'])&(df_p['Fecha']==r['Fecha'])&(df_p['Monto']==r['Monto'])
-                                df_p.at[df_p[mask].index[0], 'Estado']='Rechazado'
-                                guardar_df_completo(TAB_PAGOS, df_p); st.rerun()
+                            if c2.checkbox("Seleccionar", key=f"s{r['ID']}"): marcados.append(r['ID'])
+                            if c2.button("✅", key=f"y{r['ID']}"):
+                                cambiar_estado_pagos([r['ID']], 'Aprobado'); st.rerun()
+                            if c2.button("❌", key=f"n{r['ID']}"):
+                                cambiar_estado_pagos([r['ID']], 'Rechazado'); st.rerun()
+                    c_a, c_r = st.columns(2)
+                    if c_a.button(f"✅ Aprobar seleccionados ({len(marcados)})", disabled=not marcados):
+                        cambiar_estado_pagos(marcados, 'Aprobado'); st.rerun()
+                    if c_r.button(f"❌ Rechazar seleccionados ({len(marcados)})", disabled=not marcados):
+                        cambiar_estado_pagos(marcados, 'Rechazado'); st.rerun()
                 else: st.info("Nada pendiente")
             with t_man:
                 sel_m = st.selectbox("Socio Manual", df_u['DNI']+"-"+df_u['Nombre'])
@@ -319,30 +260,39 @@ elif st.session_state.rol == 'admin':
                     if ops_m:
                         sem_m = st.selectbox("Semana Manual", ops_m); mon_m = st.number_input("Monto Efec.", 0.0)
                         if st.button("Registrar Efectivo"):
-                            new = pd.DataFrame([{"Fecha":datetime.now().strftime("%Y-%m-%d"), "DNI":dni_m, "Grupo":grupo, "Monto":str(mon_m), "Estado":"Aprobado", "Foto":"Manual", "SemanaPagada":sem_m}])
-                            guardar_df_completo(TAB_PAGOS, pd.concat([df_p, new], ignore_index=True)); st.success("Registrado"); st.rerun()
+                            new = pd.DataFrame([{"Fecha":datetime.now().strftime("%Y-%m-%d"), "DNI":dni_m, "Grupo":grupo, "Monto":mon_m, "Estado":"Aprobado", "Foto":"Manual", "SemanaPagada":sem_m, "ID":nuevo_id_pago()}])
+                            agregar_df(TAB_PAGOS, new); st.success("Registrado"); st.rerun()
                     else: st.success("Ya pagó todo.")
         with t6:
-            if st.button("PDF"):
-                df_mm = cargar_df(TAB_MIEMBROS, COLS_MIEMBROS); df_u = cargar_df(TAB_USUARIOS, COLS_USUARIOS)
-                mism = df_mm[df_mm['NombreGrupo']==grupo]
-                dat = pd.merge(mism, df_u, left_on="DNI_Usuario", right_on="DNI")
-                rep = []
-                for _, r in dat.iterrows():
-                    cal, _, _ = generar_calendario_usuario(r['DNI'], grupo)
-                    deuda = sum(1 for c in cal if c['Estado']=='red')
-                    pag = sum(c['Monto'] for c in cal if c['Estado']=='green')
-                    rep.append({"Nombre":r['Nombre'], "Turno":r['Turno'], "Pagado":pag, "Deuda":deuda})
-                pdf_b = crear_reporte_pdf(grupo, rep)
-                b64 = base64.b64encode(pdf_b).decode()
-                st.markdown(f'<a href="data:application/octet-stream;base64,{b64}" download="Rep.pdf">Descargar</a>', unsafe_allow_html=True)
+            # El PDF se arma recién al hacer clic (y sale de la caché si el grupo no cambió)
+            st.download_button("📄 Descargar PDF", data=lambda: pdf_grupo(grupo, datos), file_name=f"Reporte_{nombre_archivo(grupo)}.pdf",
+                               mime="application/pdf", on_click="ignore")
+
+        with t7:
+            que = st.radio("Importar", ["Pagos en efectivo", "Socios"], horizontal=True)
+            hoja_i = TAB_PAGOS if que == "Pagos en efectivo" else TAB_MIEMBROS
+            st.download_button("⬇️ Plantilla CSV", ",".join(COLS_IMPORTAR[hoja_i]) + "\n", f"plantilla_{hoja_i}.csv", "text/csv", on_click="ignore")
+            arch = st.file_uploader("Archivo XLSX o CSV", type=["xlsx", "csv"], key=f"imp_{hoja_i}")
+            if arch:
+                try:
+                    validar = validar_pagos if hoja_i == TAB_PAGOS else validar_socios
+                    ok_i, malas_i = validar(grupo, leer_planilla(arch), cargar_todo())
+                except Exception as e: st.error(f"No se pudo leer el archivo: {e}"); ok_i = malas_i = pd.DataFrame()
+                c1, c2 = st.columns(2); c1.metric("Filas válidas", len(ok_i)); c2.metric("Rechazadas", len(malas_i))
+                if not malas_i.empty:
+                    st.write("Rechazadas (no se importan)"); st.dataframe(malas_i, hide_index=True, use_container_width=True)
+                if not ok_i.empty:
+                    with st.expander("Ver filas válidas"): st.dataframe(ok_i, hide_index=True, use_container_width=True)
+                    if st.button(f"Registrar {len(ok_i)} fila(s)", type="primary"):
+                        try: importar_filas(hoja_i, ok_i); st.success("Importado"); st.rerun()
+                        except Exception as e: st.error(f"Error guardando: {e}")
 
 # 3. USUARIO
 elif st.session_state.rol == 'usuario':
     st.title(f"Hola, {st.session_state.nombre_pila}")
     
     # 1. Obtener TODOS los grupos donde está el usuario
-    df_m = cargar_df(TAB_MIEMBROS, COLS_MIEMBROS)
+    datos = cargar_todo(); df_m = datos[TAB_MIEMBROS]
     # Filtramos por DNI
     mis_grupos_rows = df_m[df_m['DNI_Usuario'] == str(st.session_state.usuario)]
     
@@ -361,14 +311,17 @@ elif st.session_state.rol == 'usuario':
             st.info(f"Viendo: **{nom_g}** ({tipo_p})")
             
             # Alertas
-            df_p = cargar_df(TAB_PAGOS, COLS_PAGOS)
-            rech = df_p[(df_p['DNI']==st.session_state.usuario)&(df_p['Estado']=='Rechazado')&(df_p['Grupo']==nom_g)]
+            mis_p = buscar_df(TAB_PAGOS, COLS_PAGOS, DNI=st.session_state.usuario, Grupo=nom_g)
+            rech = mis_p[mis_p['Estado']=='Rechazado']
             if not rech.empty: st.error(f"⚠️ Tienes {len(rech)} pago(s) RECHAZADO(S) en este grupo.")
+            for id_sub in st.session_state.get('mis_subidas', []):
+                est = estado_subida(id_sub)
+                if est == "subiendo": st.info("⏳ Pago enviado, subiendo la foto del voucher...")
+                elif est == "ok": st.success("Enviado ✅")
+                elif est == "error": st.error("⚠️ Tu pago quedó registrado pero la foto no se pudo subir. Avísale al Admin.")
+            st.session_state.mis_subidas = [i for i in st.session_state.get('mis_subidas', []) if estado_subida(i) == "subiendo"]
             
-            dfv = pd.DataFrame(cal)[['Semana','Fecha','Monto','Estado']]
-            dfv['Monto'] = dfv['Monto'].apply(lambda x: f"S/. {x:.2f}")
-            dfv['Estado'] = dfv['Estado'].map({'red':'🔴','green':'🟢','grey':'⚪','orange':'🟠','yellow':'🟡'})
-            st.dataframe(dfv, hide_index=True, use_container_width=True)
+            st.dataframe(tabla_calendario(cal), hide_index=True, use_container_width=True)
             
             with st.form("pay", clear_on_submit=True):
                 ops = [f"Semana {s['Semana']} ({s['Fecha']})" for s in cal if s['Estado']!='green']
@@ -379,16 +332,23 @@ elif st.session_state.rol == 'usuario':
                     if st.form_submit_button("Enviar Pago"):
                         if uploaded and monto > 0:
                             try:
-                                timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-                                nombre_archivo = f"S{sem.split()[1]}_{timestamp}"
-                                folder_path = f"PANDEROS/{st.session_state.usuario}/{nom_g}"
-                                upload_result = cloudinary.uploader.upload(uploaded, folder=folder_path, public_id=nombre_archivo)
-                                link_foto = upload_result['secure_url']
-                                new = pd.DataFrame([{"Fecha":datetime.now().strftime("%Y-%m-%d"), "DNI":st.session_state.usuario, "Grupo":nom_g, "Monto":str(monto), "Estado":"Pendiente", "Foto":link_foto, "SemanaPagada":sem}])
-                                guardar_df_completo(TAB_PAGOS, pd.concat([df_p, new], ignore_index=True))
-                                st.success("Enviado ✅"); time.sleep(2); st.rerun()
-                            except Exception as e: st.error(f"Error imagen: {e}")
+                                st.session_state.setdefault('mis_subidas', []).append(enviar_voucher(st.session_state.usuario, nom_g, sem, monto, uploaded))
+                                st.rerun()
+                            except Exception as e: st.error(f"Error guardando: {e}")
                         else: st.error("Completa todo")
                 else: st.success("¡Felicidades! Pagaste todo este pandero.")
     else:
         st.warning("No estás inscrito en ningún grupo todavía. Contacta al Admin.")
+
+    if ruta_archivo() and st.toggle("📚 Ver mis panderos terminados"):
+        mis_a = leer_archivo(TAB_MIEMBROS, DNI_Usuario=st.session_state.usuario)
+        if mis_a.empty: st.info("No tienes panderos terminados.")
+        else:
+            pag_a = leer_archivo(TAB_PAGOS, DNI=st.session_state.usuario)
+            pag_a = pag_a[pag_a['Estado'] == 'Aprobado'].groupby([pag_a['Grupo'].astype(str), pag_a['FechaInicio'].astype(str)])['Monto'].sum()
+            claves_a = list(zip(mis_a['NombreGrupo'].astype(str), mis_a['FechaInicio'].astype(str)))  # un nombre puede repetirse en otro ciclo
+            st.dataframe(pd.DataFrame({"Grupo": [g for g, _ in claves_a], "Inicio": [f for _, f in claves_a], "Turno": mis_a['Turno'],
+                                       "Total pagado": [f"S/. {pag_a.get(k, 0):.2f}" for k in claves_a]}),
+                         hide_index=True, use_container_width=True)
+
+fin_rerun()
@@ -0,0 +1,235 @@
+# Benchmark sin conexión del Sistema Pandero.
+# Genera datos sintéticos con el mismo formato de las pestañas (COLS_*), los sirve desde un libro
+# en memoria que imita la API de gspread y mide los caminos calientes de pandero.py.
+#
+#   python benchmark.py                                   # 5.000 socios, 200 grupos, 500.000 pagos
+#   python benchmark.py --pagos 50000 --salida bench.json
+#   python benchmark.py --comparar bench.json             # sale con código 1 si algo empeoró
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from gspread.utils import a1_to_rowcol
+
+import pandero
+from pandero import (
+    TAB_USUARIOS, COLS_USUARIOS, TAB_GRUPOS, COLS_GRUPOS, TAB_MIEMBROS, COLS_MIEMBROS, TAB_PAGOS, COLS_PAGOS,
+)
+
+# --- DATOS SINTÉTICOS ---
+def generar_datos(usuarios=5000, grupos=200, pagos=500000, semilla=0):
+    # {pestaña: [encabezado, fila, ...]} con valores de texto, como los devuelve Sheets
+    rng = np.random.default_rng(semilla); hoy = datetime.now()
+    dnis = np.char.zfill((10_000_000 + rng.permutation(usuarios * 10)[:usuarios]).astype(str), 8)
+    t_u = [COLS_USUARIOS] + [[f"Socio {i}", d, f"9{i:08d}"] for i, d in enumerate(dnis)]
+
+    nombres = np.array([f"Pandero {i:03d}" for i in range(grupos)])
+    inicios = [hoy - timedelta(weeks=int(w)) for w in rng.integers(0, 52, grupos)]
+    duraciones = rng.integers(10, 51, grupos); bases = rng.choice([200.0, 400.0, 800.0], grupos)
+    t_g = [COLS_GRUPOS] + [[n, f.strftime("%Y-%m-%d"), str(d), str(b), str(b * 1.075)]
+                           for n, f, d, b in zip(nombres, inicios, duraciones, bases)]
+
+    # Cada socio entra al menos a un grupo; los turnos se reparten por grupo
+    g_m = rng.permutation(np.arange(max(usuarios, grupos * 10)) % grupos)
+    m = pd.DataFrame({'g': g_m, 'u': np.resize(rng.permutation(usuarios), len(g_m))}).drop_duplicates(['g', 'u'])
+    m['turno'] = m.groupby('g').cumcount() + 1
+    m['tipo'] = np.where(rng.random(len(m)) < 0.1, 'Medio', 'Completo')
+    t_m = [COLS_MIEMBROS] + [[nombres[g], dnis[u], str(t), tp] for g, u, t, tp in m.itertuples(index=False)]
+
+    # Pagos repartidos entre las inscripciones
+    sel = m.iloc[rng.integers(0, len(m), pagos)]
+    g, u = sel['g'].to_numpy(), sel['u'].to_numpy()
+    semana = (rng.random(pagos) * duraciones[g]).astype(int) + 1
+    fechas = np.array([f.strftime("%Y-%m-%d") for f in inicios])[g]  # basta la fecha de inicio del grupo
+    monto = bases[g] * np.where(sel['tipo'].to_numpy() == 'Medio', 0.5, 1.0)
+    estado = rng.choice(['Aprobado', 'Pendiente', 'Rechazado'], pagos, p=[0.85, 0.1, 0.05])
+    terminado = np.array([f + timedelta(weeks=int(d)) < hoy for f, d in zip(inicios, duraciones)])
+    estado = np.where(terminado[g] & (estado == 'Pendiente'), 'Aprobado', estado)  # los grupos cerrados ya validaron todo
+    foto = np.where(rng.random(pagos) < 0.7, "https://res.cloudinary.com/demo/image/upload/v1/voucher.jpg", "Manual")
+    ids = np.char.mod('b%011x', np.arange(pagos))
+    cols = [fechas, dnis[u], nombres[g], monto.astype(str), estado, foto, np.char.add("Semana ", semana.astype(str)), ids]
+    t_p = [COLS_PAGOS] + np.column_stack(cols).tolist()
+    return {TAB_USUARIOS: t_u, TAB_GRUPOS: t_g, TAB_MIEMBROS: t_m, TAB_PAGOS: t_p}
+
+# --- SHEETS EN MEMORIA ---
+class HojaEnMemoria:
+    # Lo que pandero usa de gspread.Worksheet, sobre una lista de filas
+    def __init__(self, libro, titulo, filas, id_hoja):
+        self.libro = self.spreadsheet = libro; self.title = titulo; self.filas = filas; self.id = id_hoja
+
+    def _llamada(self): self.libro.llamadas += 1
+
+    def get_all_values(self): self._llamada(); return self.filas
+    def row_values(self, n): self._llamada(); return list(self.filas[n - 1]) if len(self.filas) >= n else []
+    def append_row(self, fila, **kw): self.append_rows([fila])
+    def append_rows(self, filas, **kw): self._llamada(); self.filas.extend([[str(v) for v in f] for f in filas])
+    def clear(self): self._llamada(); self.filas[:] = []
+
+    def _escribir(self, rango, valores):
+        f0, c0 = a1_to_rowcol(rango.split(':')[0])
+        for i, fila in enumerate(valores):
+            while len(self.filas) < f0 + i: self.filas.append([])
+            destino = self.filas[f0 + i - 1]
+            for j, v in enumerate(fila):
+                while len(destino) < c0 + j: destino.append("")
+                destino[c0 + j - 1] = str(v)
+
+    def update(self, values=None, range_name=None, **kw):
+        self._llamada(); self._escribir(range_name or 'A1', values)
+
+    def batch_update(self, datos, **kw):
+        self._llamada()
+        for d in datos: self._escribir(d['range'], d['values'])
+
+    def batch_get(self, rangos, **kw):
+        # Sólo columnas enteras ('H:H'), que es lo que pandero pide para ubicar filas por clave
+        self._llamada(); res = []
+        for r in rangos:
+            c = a1_to_rowcol(r.split(':')[0] + "1")[1] - 1
+            col = [[f[c]] if len(f) > c and f[c] != "" else [] for f in self.filas]
+            while col and not col[-1]: col.pop()
+            res.append(col)
+        return res
+
+class LibroEnMemoria:
+    # Lo que pandero usa de gspread.Spreadsheet; cuenta las llamadas a la API
+    def __init__(self, tablas):
+        self.llamadas = 0; self.hojas = {t: HojaEnMemoria(self, t, filas, n) for n, (t, filas) in enumerate(tablas.items())}
+
+    def worksheet(self, titulo): self.llamadas += 1; return self.hojas[titulo]
+
+    def batch_update(self, cuerpo):
+        # Sólo deleteDimension de filas (borrado al archivar), aplicados en orden como en la API
+        self.llamadas += 1; por_id = {h.id: h for h in self.hojas.values()}
+        for r in cuerpo['requests']:
+            d = r['deleteDimension']['range']; del por_id[d['sheetId']].filas[d['startIndex']:d['endIndex']]
+
+    def values_batch_get(self, rangos, **kw):
+        self.llamadas += 1
+        return {'valueRanges': [{'range': r, 'values': self.hojas[r.strip("'")].filas} for r in rangos]}
+
+def conectar(libro):
+    # Reemplaza la conexión a Google por el libro en memoria (mismo contrato que pandero._conexion)
+    cx = {'libro': libro, 'hojas': {}, 'lock': threading.Lock()}
+    def _conexion(): return cx
+    _conexion.clear = lambda: None
+    pandero._conexion = _conexion
+
+# --- MEDICIÓN ---
+def medir(nombre, fn, repeticiones, libro):
+    tiempos = []; antes = libro.llamadas
+    for i in range(repeticiones):
+        t = time.perf_counter(); fn(i); tiempos.append((time.perf_counter() - t) * 1000)
+    return {'caso': nombre, 'repeticiones': repeticiones, 'min_ms': round(min(tiempos), 3),
+            'mediana_ms': round(statistics.median(tiempos), 3), 'media_ms': round(statistics.mean(tiempos), 3),
+            'max_ms': round(max(tiempos), 3), 'llamadas_api': (libro.llamadas - antes) / repeticiones}
+
+def correr(args):
+    tablas = generar_datos(args.usuarios, args.grupos, args.pagos, args.semilla)
+    libro = LibroEnMemoria(tablas); conectar(libro)
+    if args.sqlite:
+        os.environ["PANDERO_SQLITE"] = ":memory:"
+        pandero.copiar_almacen(pandero.AlmacenSheets(), pandero.almacen())
+    archivados = {}
+    if args.archivo:  # los grupos terminados pasan a Parquet antes de medir: la carga sólo trae lo activo
+        os.environ["PANDERO_ARCHIVO"] = args.archivo
+        archivados = pandero.archivar_grupos(pandero.archivables(pandero.cargar_todo()))
+    rng = np.random.default_rng(args.semilla); r = args.repeticiones
+
+    def carga_fria(i):
+        for t in pandero._TABLAS: pandero.invalidar_tabla(t)
+        pandero.cargar_todo()
+
+    resultados = [medir('carga_fria', carga_fria, max(1, min(r, 3)), libro),
+                  medir('carga_caliente', lambda i: pandero.cargar_todo(), r, libro)]
+    datos = pandero.cargar_todo()
+    df_u, df_m, df_p = datos[TAB_USUARIOS], datos[TAB_MIEMBROS], datos[TAB_PAGOS]
+    dnis = df_u['DNI'].sample(r, replace=True, random_state=args.semilla).tolist()
+    inscritos = df_m.sample(r, replace=True, random_state=args.semilla)[['DNI_Usuario', 'NombreGrupo']].astype(str).values.tolist()
+    mayor = df_m['NombreGrupo'].astype(str).value_counts().index[0]
+    pendientes = df_p.loc[df_p['Estado'] == 'Pendiente', 'ID'].tolist()
+    rng.shuffle(pendientes)
+
+    def aprobar(ids):
+        # Una aprobación por ID, como clics de varios admins; se mide hasta que la cola las escribe
+        for x in ids: pandero.cambiar_estado_pagos([x], 'Aprobado')
+        pandero.esperar_escrituras()
+
+    def zip_frio(i):
+        pandero._cache_pdfs()['pdfs'].clear(); pandero.zip_reportes(pandero.cargar_todo())
+
+    def admin_miembros(i):
+        socios, _ = pandero.miembros_grupo(mayor, pandero.cargar_todo())
+        for _, cal in socios: pandero.tabla_calendario(cal)
+
+    resultados += [
+        medir('login_dni', lambda i: pandero.buscar_df(TAB_USUARIOS, COLS_USUARIOS, DNI=dnis[i]), r, libro),
+        medir('calendario_usuario', lambda i: pandero.generar_calendario_usuario(*inscritos[i]), r, libro),
+        medir('admin_miembros', admin_miembros, r, libro),
+        medir('panel_resumen', lambda i: pandero.resumen_grupos(), r, libro),
+        medir('reporte_pdf', lambda i: pandero.crear_reporte_pdf(mayor, pandero.reporte_grupo(mayor, pandero.cargar_todo())), r, libro),
+        medir('zip_todos_frio', zip_frio, max(1, min(r, 2)), libro),
+        medir('zip_todos_cache', lambda i: pandero.zip_reportes(pandero.cargar_todo()), r, libro),
+        medir('aprobar_pago', lambda i: aprobar(pendientes[i:i + 1]), min(r, len(pendientes)), libro),
+        medir('aprobar_rafaga_50', lambda i: aprobar(pendientes[r + 50 * i:r + 50 * (i + 1)]), min(r, (len(pendientes) - r) // 50), libro),
+    ]
+    return {'meta': {'fecha': datetime.now().isoformat(timespec='seconds'), 'version': _version(),
+                     'python': platform.python_version(), 'pandas': pd.__version__,
+                     'almacen': pandero.almacen().nombre, 'usuarios': args.usuarios, 'grupos': args.grupos,
+                     'pagos': args.pagos, 'miembros': len(df_m), 'grupo_medido': mayor,
+                     'socios_grupo_medido': int((df_m['NombreGrupo'] == mayor).sum()), 'archivados': archivados},
+            'resultados': resultados}
+
+def _version():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception: return None
+
+def comparar(actual, anterior, tolerancia):
+    # Casos cuya mediana empeoró más que la tolerancia respecto a una corrida anterior
+    previos = {x['caso']: x for x in anterior['resultados']}
+    return [{'caso': x['caso'], 'antes_ms': previos[x['caso']]['mediana_ms'], 'ahora_ms': x['mediana_ms']}
+            for x in actual['resultados']
+            if x['caso'] in previos and x['mediana_ms'] > previos[x['caso']]['mediana_ms'] * tolerancia]
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark sin conexión del Sistema Pandero")
+    ap.add_argument("--usuarios", type=int, default=5000)
+    ap.add_argument("--grupos", type=int, default=200)
+    ap.add_argument("--pagos", type=int, default=500000)
+    ap.add_argument("--repeticiones", type=int, default=5)
+    ap.add_argument("--semilla", type=int, default=0)
+    ap.add_argument("--sqlite", action="store_true", help="medir el backend SQLite (en memoria) en vez de Sheets")
+    ap.add_argument("--archivo", help="carpeta donde archivar los grupos terminados antes de medir")
+    ap.add_argument("--salida", help="guardar el resultado JSON en este archivo")
+    ap.add_argument("--comparar", help="JSON de una corrida anterior para detectar regresiones")
+    ap.add_argument("--tolerancia", type=float, default=1.25, help="mediana máxima permitida como múltiplo de la anterior")
+    args = ap.parse_args()
+    for nombre in list(logging.root.manager.loggerDict):
+        if nombre.startswith("streamlit"): logging.getLogger(nombre).setLevel(logging.ERROR)
+
+    resultado = correr(args)
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    print(texto)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f: f.write(texto + "\n")
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f: anterior = json.load(f)
+        if any(anterior['meta'].get(k) != resultado['meta'][k] for k in ('usuarios', 'grupos', 'pagos', 'almacen')):
+            print("AVISO: la corrida anterior usó otro tamaño de datos o almacén", file=sys.stderr)
+        peores = comparar(resultado, anterior, args.tolerancia)
+        for p in peores: print(f"REGRESIÓN {p['caso']}: {p['antes_ms']} ms -> {p['ahora_ms']} ms", file=sys.stderr)
+        if peores: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1372 @@
+# Datos y cálculos del Sistema Pandero, sin pantallas: app.py arma la interfaz con esto
+# y benchmark.py lo importa para medirlo sin levantar Streamlit.
+import streamlit as st
+import pandas as pd
+import numpy as np
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+import time
+import threading
+import sqlite3
+import contextlib
+import uuid
+from datetime import datetime, timedelta
+from fpdf import FPDF
+import io
+import os
+import json
+import logging
+import random
+import requests
+import re
+import hashlib
+import html
+import zipfile
+import multiprocessing
+import csv
+import unicodedata
+import openpyxl
+from collections import deque, Counter
+import cloudinary
+import cloudinary.uploader
+import cloudinary.api
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# --- CONEXIÓN CLOUDINARY ---
+def init_cloudinary():
+    try:
+        cloudinary.config(
+            cloud_name = st.secrets["cloudinary"]["cloud_name"],
+            api_key = st.secrets["cloudinary"]["api_key"],
+            api_secret = st.secrets["cloudinary"]["api_secret"],
+            secure = True
+        )
+    except: pass
+init_cloudinary()
+
+# --- MÉTRICAS DE RENDIMIENTO ---
+# Tramos con tiempo (medir) y contadores (contar) compartidos por todo el proceso. Lo que pasa durante
+# una ejecución del script también se suma a su resumen (inicio_rerun/fin_rerun) para ubicar las lentas.
+# Cada resumen cerrado sale además como una línea JSON por el logger "pandero.perf".
+log_perf = logging.getLogger("pandero.perf")
+_hilo = threading.local()
+
+@st.cache_resource(show_spinner=False)
+def _metricas():
+    return {'lock': threading.Lock(), 'contadores': {}, 'tramos': deque(maxlen=5000), 'reruns': deque(maxlen=500)}
+
+def contar(nombre, n=1):
+    m = _metricas(); r = getattr(_hilo, 'rerun', None)
+    with m['lock']:
+        m['contadores'][nombre] = m['contadores'].get(nombre, 0) + n
+        if r is not None: r['contadores'][nombre] = r['contadores'].get(nombre, 0) + n
+
+@contextlib.contextmanager
+def medir(nombre, **etiquetas):
+    t0 = time.perf_counter()
+    try: yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000; m = _metricas(); r = getattr(_hilo, 'rerun', None)
+        with m['lock']:
+            m['tramos'].append({'ts': time.time(), 'tramo': nombre, 'ms': round(ms, 3), **etiquetas})
+            if r is not None:
+                t = r['tramos'].setdefault(nombre, [0, 0.0]); t[0] += 1; t[1] += ms
+                r['fin'] = time.perf_counter()
+
+def _cerrar_rerun(r, completo):
+    if r.get('cerrado'): return
+    r['cerrado'] = True
+    fila = {'ts': r['ts'], 'pagina': r['pagina'], 'completo': completo, 'total_ms': round((r['fin'] - r['t0']) * 1000, 3),
+            'tramos': {k: {'n': n, 'ms': round(ms, 3)} for k, (n, ms) in r['tramos'].items()}, 'contadores': r['contadores']}
+    m = _metricas()
+    with m['lock']: m['reruns'].append(fila)
+    log_perf.info(json.dumps(fila, ensure_ascii=False))
+
+def inicio_rerun(pagina):
+    # Si la ejecución anterior de la sesión terminó con st.rerun()/st.stop() no llegó a fin_rerun: se cierra aquí
+    # con la hora de su último tramo
+    previa = st.session_state.get('_perf_rerun')
+    if previa: _cerrar_rerun(previa, False)
+    ahora = time.perf_counter()
+    st.session_state._perf_rerun = _hilo.rerun = {'ts': time.time(), 'pagina': pagina, 't0': ahora, 'fin': ahora,
+                                                   'tramos': {}, 'contadores': {}}
+
+def fin_rerun():
+    r = getattr(_hilo, 'rerun', None)
+    if r is None: return
+    r['fin'] = time.perf_counter(); _cerrar_rerun(r, True); _hilo.rerun = None
+
+def resumen_tramos():
+    # Por tramo (y etiqueta de caché si tiene): cantidad, total, p50, p95 y máximo en ms
+    with _metricas()['lock']: df = pd.DataFrame(list(_metricas()['tramos']))
+    if df.empty: return df
+    df['tramo'] = df['tramo'] + df.get('cache', pd.Series("", index=df.index)).fillna("").map(lambda c: f" ({c})" if c else "")
+    g = df.groupby('tramo')['ms']
+    return pd.DataFrame({'n': g.size(), 'total_ms': g.sum(), 'p50_ms': g.median(), 'p95_ms': g.quantile(0.95),
+                         'max_ms': g.max()}).round(1).sort_values('total_ms', ascending=False)
+
+def reruns_lentos(n=20):
+    with _metricas()['lock']: filas = list(_metricas()['reruns'])
+    return sorted(filas, key=lambda r: r['total_ms'], reverse=True)[:n]
+
+def contadores():
+    with _metricas()['lock']: return dict(_metricas()['contadores'])
+
+def exportar_metricas():
+    # JSON Lines: contadores, un registro por tramo y uno por ejecución del script
+    m = _metricas()
+    with m['lock']:
+        filas = [{'tipo': 'contadores', 'ts': time.time(), **m['contadores']}]
+        filas += [{'tipo': 'tramo', **t} for t in m['tramos']] + [{'tipo': 'rerun', **r} for r in m['reruns']]
+    return "\n".join(json.dumps(f, ensure_ascii=False, default=str) for f in filas) + "\n"
+
+def reiniciar_metricas():
+    m = _metricas()
+    with m['lock']: m['contadores'].clear(); m['tramos'].clear(); m['reruns'].clear()
+
+def _respuesta_sheets(resp, *args, **kwargs):
+    # Hook de requests: cuenta cada llamada HTTP a la API de Google, y las rechazadas por cuota (429)
+    contar('sheets_api')
+    if resp.status_code == 429: contar('sheets_429')
+
+# --- CONEXIÓN GOOGLE SHEETS ---
+# Un solo cliente autorizado y un solo libro para todo el proceso (compartido entre sesiones).
+# gspread envuelve las credenciales en una sesión autorizada que renueva el token sola al expirar.
+@st.cache_resource(show_spinner=False)
+def _conexion():
+    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+    creds_dict = dict(st.secrets["gcp_service_account"])
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    client = gspread.authorize(creds)
+    try: client.http_client.session.hooks['response'].append(_respuesta_sheets)
+    except AttributeError: pass
+    return {'libro': client.open("BASE_DATOS_PANDERO"), 'hojas': {}, 'lock': threading.Lock()}
+
+def _hoja(hoja_nombre):
+    # Worksheet de la pestaña; si falla se rehace la conexión una vez y si vuelve a fallar se propaga el error
+    for intento in range(2):
+        try:
+            with medir('conectar_db', hoja=hoja_nombre):
+                cx = _conexion()
+                with cx['lock']:
+                    if hoja_nombre not in cx['hojas']: cx['hojas'][hoja_nombre] = cx['libro'].worksheet(hoja_nombre)
+                    return cx['hojas'][hoja_nombre]
+        except Exception:
+            if intento: raise
+            _conexion.clear()  # credenciales o libro inválidos
+
+def conectar_db(hoja_nombre):
+    try: return _hoja(hoja_nombre)
+    except Exception as error:
+        st.error(f"⚠️ Error de conexión (Espera 1 min): {error}")
+        st.stop()
+
+def _valores_a_df(valores, columnas_obligatorias):
+    # Misma conversión que get_all_records (números normalizados) pero a partir de la matriz cruda
+    if not valores or not valores[0]: return pd.DataFrame(columns=columnas_obligatorias)
+    enc = valores[0]; n = len(enc)
+    filas = [gspread.utils.numericise_all((f + [""] * n)[:n]) for f in valores[1:]]
+    df = pd.DataFrame(filas, columns=enc).astype(str)
+    df = df[[c for c in df.columns if c]]
+    for col in columnas_obligatorias:
+        if col not in df.columns: df[col] = ""
+    return df
+
+# --- CARGA CON CACHÉ (por pestaña, compartida entre sesiones) ---
+# Cada pestaña tiene su propio DataFrame, hora de lectura y versión. Una escritura parcha
+# sólo la pestaña que tocó (y sube su versión); las demás siguen sirviéndose de memoria.
+CACHE_TTL = 60
+
+@st.cache_resource(show_spinner=False)
+def _cache_tablas():
+    return {'tablas': {}, 'lock': threading.RLock()}
+
+def version_tabla(hoja):
+    e = _cache_tablas()['tablas'].get(hoja)
+    return e['version'] if e else 0
+
+def _cache_vigente(hoja):
+    # Con cambios aún en la cola de escritura la hoja no tiene lo último: se sigue sirviendo la caché ya parchada
+    e = _cache_tablas()['tablas'].get(hoja)
+    return e if e and (time.time() - e['ts'] < CACHE_TTL or hoja in hojas_en_cola()) else None
+
+def _cache_guardar(hoja, df, version_leida=None):
+    # Si alguien escribió mientras leíamos, la lectura no trae ese cambio: se conserva la caché parchada,
+    # marcada como vencida para que la próxima lectura la vuelva a pedir
+    c = _cache_tablas()
+    with c['lock']:
+        v = version_tabla(hoja); vigente = version_leida is None or version_leida == v
+        if not vigente and hoja in c['tablas']:
+            e = c['tablas'][hoja]; e['ts'] = 0
+            return e
+        df, errores = aplicar_esquema(hoja, df); previa = c['tablas'].get(hoja)
+        c['tablas'][hoja] = e = {'df': df, 'ts': time.time(), 'version': v + 1, 'indices': {}, 'errores': errores}
+        if hoja == TAB_PAGOS and previa and previa.get('resumen'): _arrastrar_resumen(previa, e)
+    return e
+
+def huella_tabla(hoja):
+    # Hash del contenido en caché (se calcula una vez por versión): a diferencia de la versión, una relectura
+    # que trae lo mismo no lo cambia
+    c = _cache_tablas()
+    with c['lock']:
+        e = c['tablas'].get(hoja)
+        if e is None: return None
+        if e.get('huella', (None,))[0] != e['version']:
+            e['huella'] = (e['version'], hashlib.sha1(pd.util.hash_pandas_object(e['df'], index=False).to_numpy().tobytes()).hexdigest())
+        return e['huella'][1]
+
+def invalidar_tabla(hoja):
+    c = _cache_tablas()
+    with c['lock']:
+        if hoja in c['tablas']: c['tablas'][hoja]['ts'] = 0
+
+def _parchar_agregar(hoja, df_nuevo):
+    c = _cache_tablas()
+    with c['lock']:
+        e = c['tablas'].get(hoja)
+        if e is None: return
+        n = len(e['df']); viejo = e['df']
+        cols = list(viejo.columns) + [x for x in df_nuevo.columns if x not in viejo.columns]
+        nuevo, errores = aplicar_esquema(hoja, df_nuevo.reindex(columns=cols, fill_value="").set_axis(range(n, n + len(df_nuevo))))
+        viejo = viejo.reindex(columns=cols, fill_value="")
+        for col in cols:
+            if isinstance(viejo[col].dtype, pd.CategoricalDtype):  # mismas categorías en ambos: el concat las conserva
+                viejo[col] = viejo[col].cat.add_categories(nuevo[col].cat.categories.difference(viejo[col].cat.categories))
+                nuevo[col] = nuevo[col].cat.set_categories(viejo[col].cat.categories)
+        e['df'] = pd.concat([viejo, nuevo]); e['version'] += 1; e['errores'] = e['errores'] + errores
+        for col, ind in e['indices'].items(): ind.update(zip(e['df'][col].iloc[n:], e['df'].index[n:]))
+        if hoja == TAB_PAGOS: _resumen_pagos(e, None, e['df'].iloc[n:])
+
+def _parchar_celdas(hoja, df, indices, columnas):
+    c = _cache_tablas()
+    with c['lock']:
+        e = c['tablas'].get(hoja)
+        if e is None: return
+        dfc = e['df'].copy(); indices = [i for i in indices if i in dfc.index]
+        antes = e['df'].loc[indices]
+        valores, _ = aplicar_esquema(hoja, df.loc[indices, columnas])
+        for col in columnas:
+            if col not in dfc.columns: dfc[col] = ""
+            if isinstance(dfc[col].dtype, pd.CategoricalDtype):
+                dfc[col] = dfc[col].cat.add_categories(pd.Index(valores[col].dropna().unique()).difference(dfc[col].cat.categories))
+            for i in indices: dfc.at[i, col] = valores.at[i, col]
+        e['df'] = dfc; e['version'] += 1
+        for col in columnas: e['indices'].pop(col, None)
+        if hoja == TAB_PAGOS and set(columnas) & set(COLS_TOTALES): _resumen_pagos(e, antes, dfc.loc[indices])
+
+def _parchar_borrar(hoja, claves):
+    # Saca de la caché las filas con esas claves (CLAVES) y la renumera desde 0, como queda la tabla
+    c = _cache_tablas()
+    with c['lock']:
+        e = c['tablas'].get(hoja)
+        if e is None: return
+        df = e['df']; sale = np.array([k in claves for k in zip(*(df[k].map(_texto) for k in CLAVES[hoja]))], dtype=bool)
+        if hoja == TAB_PAGOS: _resumen_pagos(e, df[sale], None)
+        e['df'] = df[~sale].reset_index(drop=True); e['version'] += 1; e['indices'] = {}
+
+def indice_tabla(hoja, columnas_obligatorias, col):
+    # {valor de col: índice de fila}; se arma una vez por lectura y los parches lo mantienen al día
+    e = _cache_vigente(hoja)
+    if e is None:
+        cargar_df(hoja, columnas_obligatorias); e = _cache_tablas()['tablas'][hoja]
+    with _cache_tablas()['lock']:
+        if col not in e['indices']: e['indices'][col] = dict(zip(e['df'][col], e['df'].index))
+        return e['indices'][col]
+
+def _leer(hojas):
+    # Una lectura fallida nunca se guarda como tabla vacía: si todas esas pestañas ya estaban en caché se siguen
+    # sirviendo (vencidas, así se reintenta la próxima vez) y se devuelve None; si no, es un error de conexión
+    try:
+        res = almacen().leer(hojas)
+        if TAB_PAGOS in res: _completar_ids(res[TAB_PAGOS])
+        return res
+    except Exception as error:
+        contar('lectura_fallida'); log_perf.warning(json.dumps({'lectura_fallida': list(hojas), 'error': str(error)}, ensure_ascii=False))
+        if all(h in _cache_tablas()['tablas'] for h in hojas): return None
+        if get_script_run_ctx(suppress_warning=True) is None: raise
+        st.error(f"⚠️ Error de conexión (Espera 1 min): {error}")
+        st.stop()
+
+def cargar_df(hoja, columnas_obligatorias):
+    e = _cache_vigente(hoja); contar('cache_hit' if e else 'cache_miss')
+    with medir('cargar_df', hoja=hoja, cache='hit' if e else 'miss'):
+        if e is None:
+            v = version_tabla(hoja); leido = _leer({hoja: columnas_obligatorias})
+            e = _cache_guardar(hoja, leido[hoja], v) if leido else _cache_tablas()['tablas'][hoja]
+        return e['df'].copy()
+
+def guardar_df_completo(hoja, df):
+    # Reemplaza la tabla entera; si falla se invalida la caché y el error sigue hacia quien llamó
+    try:
+        with medir('guardar_df_completo', hoja=hoja, filas=len(df)):
+            almacen().reemplazar(hoja, df)
+            _cache_guardar(hoja, df.reset_index(drop=True))
+    except Exception: invalidar_tabla(hoja); raise
+
+# --- ESCRITURA POR FILAS (sin borrar la hoja) ---
+def _a_celda(v):
+    try:
+        if pd.isna(v): return ""
+    except (TypeError, ValueError): pass
+    if isinstance(v, (pd.Timestamp, datetime)): return v.strftime("%Y-%m-%d")
+    return v.item() if hasattr(v, 'item') else v  # numpy -> python para el JSON de la API
+
+def _encabezado(ws, columnas):
+    # Encabezado real de la hoja; si faltan columnas se agregan al final de la fila 1
+    enc = ws.row_values(1)
+    faltan = [c for c in columnas if c not in enc]
+    if faltan:
+        enc = enc + faltan
+        ws.update(range_name='A1', values=[enc])
+    return enc
+
+def _agregar(hoja, df_nuevo):
+    with medir('agregar_df', hoja=hoja, filas=len(df_nuevo)):
+        ticket = almacen().agregar(hoja, df_nuevo)
+        _parchar_agregar(hoja, df_nuevo)
+        return ticket
+
+def agregar_df(hoja, df_nuevo):
+    # Agrega las filas de df_nuevo al final de la tabla (sin tocar lo existente).
+    # Con Sheets devuelve el ID de la escritura en cola (ver estado_escritura); con SQLite ya quedó escrito.
+    # Un error se muestra en pantalla; dentro de una transacción va _agregar, que lo deja llegar a transaccion()
+    try: return _agregar(hoja, df_nuevo)
+    except Exception as e: invalidar_tabla(hoja); st.error(f"Error guardando: {e}")
+
+def _claves_filas(hoja, indices):
+    # {índice: valores de CLAVES[hoja]} de esas filas tal como están en la caché
+    c = _cache_tablas()
+    with c['lock']:
+        e = c['tablas'].get(hoja); df = e['df'] if e else pd.DataFrame()
+        claves = {i: tuple(_texto(df.at[i, k]) if k in df.columns else "" for k in CLAVES[hoja]) for i in indices if i in df.index}
+    if len(claves) < len(set(indices)): raise KeyError(f"Filas que ya no están en la caché de '{hoja}': vuelve a cargar la página")
+    return claves
+
+def actualizar_df(hoja, df, indices, columnas):
+    # Escribe sólo las celdas indices x columnas de df. Cada fila va con su clave (CLAVES) tal como está en la caché:
+    # el almacén escribe en la fila que hoy tiene esa clave y rechaza la escritura si ya no la encuentra
+    try:
+        with medir('actualizar_df', hoja=hoja, celdas=len(indices) * len(columnas)):
+            ticket = almacen().actualizar(hoja, df, indices, columnas, _claves_filas(hoja, indices))
+            _parchar_celdas(hoja, df, indices, columnas)
+            return ticket
+    except Exception as e: invalidar_tabla(hoja); st.error(f"Error guardando: {e}")
+
+def _borrar(hoja, df):
+    # Borra de la tabla las filas de df ubicándolas por su clave (CLAVES), no por posición: lo que otra sesión
+    # agregue o cambie mientras tanto no se toca. Con Sheets devuelve el ID de la escritura en cola
+    claves = [tuple(_texto(v) for v in k) for k in df[CLAVES[hoja]].itertuples(index=False)]
+    with medir('borrar_df', hoja=hoja, filas=len(claves)):
+        ticket = almacen().borrar(hoja, claves)
+        _parchar_borrar(hoja, set(claves))
+        return ticket
+
+def buscar_df(hoja, columnas_obligatorias, **filtros):
+    # Filas cuyas columnas son iguales a los filtros: con SQLite va por índice, con Sheets filtra la caché
+    res = almacen().buscar(hoja, columnas_obligatorias, filtros)
+    if res is not None: return res
+    df = cargar_df(hoja, columnas_obligatorias); mask = pd.Series(True, index=df.index)
+    for col, valor in filtros.items(): mask &= df[col] == str(valor)
+    return df[mask]
+
+# --- VARIABLES ---
+TAB_USUARIOS = 'usuarios'; COLS_USUARIOS = ["Nombre", "DNI", "Celular"]
+TAB_GRUPOS = 'grupos'; COLS_GRUPOS = ["NombreGrupo", "FechaInicio", "SemanasDuracion", "MontoBase", "MontoInteres"]
+TAB_MIEMBROS = 'miembros'; COLS_MIEMBROS = ["NombreGrupo", "DNI_Usuario", "Turno", "Tipo"]
+TAB_PAGOS = 'pagos'; COLS_PAGOS = ["Fecha", "DNI", "Grupo", "Monto", "Estado", "Foto", "SemanaPagada", "ID"]
+
+_TABLAS = {TAB_USUARIOS: COLS_USUARIOS, TAB_GRUPOS: COLS_GRUPOS, TAB_MIEMBROS: COLS_MIEMBROS, TAB_PAGOS: COLS_PAGOS}
+# Columnas que identifican cada fila: una escritura de celdas ubica la fila por ellas, nunca por su posición
+CLAVES = {TAB_USUARIOS: ['DNI'], TAB_GRUPOS: ['NombreGrupo'], TAB_MIEMBROS: ['NombreGrupo', 'DNI_Usuario'], TAB_PAGOS: ['ID']}
+
+def nuevo_id_pago(): return "p" + uuid.uuid4().hex[:11]  # con letra adelante: la hoja nunca lo lee como número
+
+# --- ESQUEMA: tipos por columna, aplicados una sola vez al cargar ---
+ESQUEMAS = {
+    TAB_USUARIOS: {'Nombre': 'texto', 'DNI': 'texto', 'Celular': 'texto'},
+    TAB_GRUPOS: {'NombreGrupo': 'categoria', 'FechaInicio': 'fecha', 'SemanasDuracion': 'entero', 'MontoBase': 'numero', 'MontoInteres': 'numero'},
+    TAB_MIEMBROS: {'NombreGrupo': 'categoria', 'DNI_Usuario': 'texto', 'Turno': 'entero', 'Tipo': 'categoria'},
+    TAB_PAGOS: {'Fecha': 'fecha', 'DNI': 'categoria', 'Grupo': 'categoria', 'Monto': 'numero', 'Estado': 'categoria',
+                'Foto': 'texto', 'SemanaPagada': 'categoria', 'ID': 'texto'},
+}
+
+def aplicar_esquema(hoja, df):
+    # Devuelve (df tipado, celdas inválidas). Una celda con algo escrito que no se puede convertir
+    # queda vacía (NaN/NaT) y se reporta con su fila en la hoja, en lugar de perderse en silencio.
+    df = df.copy(); errores = []
+    for col, tipo in ESQUEMAS.get(hoja, {}).items():
+        if col not in df.columns: continue
+        orig = df[col]
+        if tipo in ('numero', 'entero'):
+            val = pd.to_numeric(orig, errors='coerce')
+            if tipo == 'entero': val = np.trunc(val).astype('Int64')
+        elif tipo == 'fecha':
+            val = orig if pd.api.types.is_datetime64_any_dtype(orig) else \
+                  pd.to_datetime(orig.astype(str).str.split(" ").str[0], format="%Y-%m-%d", errors='coerce')
+        elif tipo == 'categoria':
+            df[col] = orig.fillna("").astype(str).astype('category') if not isinstance(orig.dtype, pd.CategoricalDtype) else orig
+            continue
+        else:
+            df[col] = orig.fillna("").astype(str); continue
+        texto = orig.astype(str).str.strip()
+        malos = val.isna() & orig.notna() & ~texto.isin(["", "nan", "NaT", "<NA>", "None"])
+        errores += [{'Hoja': hoja, 'Fila': int(i) + 2, 'Columna': col, 'Valor': orig.at[i]} for i in df.index[malos.to_numpy()]]
+        df[col] = val
+    return df, errores
+
+def _completar_ids(df):
+    # Pagos anteriores a los IDs: la primera vez que se leen se les escribe uno de verdad en la base, nunca uno
+    # derivado de su posición (que cambia al archivar o al editar la hoja). df es la lectura cruda, y se completa
+    vacios = df.index[(df['ID'] == "") & (df != "").any(axis=1)]
+    if len(vacios):
+        ids = {i: nuevo_id_pago() for i in vacios}
+        almacen().completar_ids(TAB_PAGOS, df, ids); df.loc[list(ids), 'ID'] = list(ids.values())
+        contar('ids_asignados', len(ids))
+
+def errores_datos():
+    # Celdas inválidas de todas las pestañas en caché (para avisar al admin)
+    return [x for e in list(_cache_tablas()['tablas'].values()) for x in e.get('errores', [])]
+
+def cargar_todo():
+    # Lee en una sola pasada (un values:batchGet en Sheets) sólo las pestañas vencidas -> {hoja: DataFrame}
+    vencidas = {h: version_tabla(h) for h in _TABLAS if _cache_vigente(h) is None}
+    if vencidas:
+        with medir('leer_vencidas', hojas=",".join(vencidas)):
+            for h, df in (_leer({h: _TABLAS[h] for h in vencidas}) or {}).items(): _cache_guardar(h, df, vencidas[h])
+        contar('cache_miss', len(vencidas))
+    return {h: _cache_tablas()['tablas'][h]['df'].copy() if h in vencidas else cargar_df(h, c) for h, c in _TABLAS.items()}
+
+# --- COLA DE ESCRITURA (Google Sheets) ---
+# Las escrituras de todas las sesiones entran a una cola; un hilo las junta durante VENTANA_ESCRITURA
+# segundos y por pestaña hace un solo append_rows (filas nuevas), un solo batch_update (celdas, gana la
+# última) y, al final, un solo borrado de filas. Celdas y borrados se ubican por la clave de su fila (CLAVES), leída
+# de la hoja justo antes de escribir: si una clave ya no está (o está repetida) ese cambio se rechaza en lugar de
+# caer en otra fila. Como borrar corre las filas de abajo, sólo se borra desde este hilo. Los 429 y 5xx se
+# reintentan con espera exponencial con jitter; un append_rows sólo se repite con las filas que no entraron. La caché ya se parchó al encolar; si algo falla o se rechaza,
+# la pestaña se invalida para volver a leer lo que de verdad quedó.
+VENTANA_ESCRITURA = 0.5; REINTENTOS = 7; ESPERA_MAX = 32
+EN_COLA = "en_cola"; ESCRIBIENDO = "escribiendo"; ESCRITA = "ok"; FALLIDA = "error"
+
+@st.cache_resource(show_spinner=False)
+def _cola():
+    c = {'cond': threading.Condition(), 'pendientes': [], 'tickets': {}}
+    threading.Thread(target=_trabajador_escrituras, args=(c,), daemon=True, name="escrituras").start()
+    return c
+
+def encolar_escritura(hoja, agregar=None, celdas=None, borrar=None):
+    # agregar: DataFrame de filas nuevas; celdas: {(clave de la fila, columna): valor}; borrar: [clave de la fila].
+    # Devuelve el ID del ticket.
+    c = _cola(); t = {'id': uuid.uuid4().hex[:12], 'hoja': hoja, 'agregar': agregar, 'celdas': celdas or {},
+                      'borrar': borrar or [], 'estado': EN_COLA, 'error': None, 'ts': time.time()}
+    with c['cond']:
+        c['tickets'][t['id']] = t; c['pendientes'].append(t)
+        for k in [k for k, x in c['tickets'].items() if x['estado'] in (ESCRITA, FALLIDA)][:-500]: c['tickets'].pop(k)
+        c['cond'].notify_all()
+    if get_script_run_ctx(suppress_warning=True) is not None:  # desde una pantalla: la sesión sigue su estado
+        st.session_state.setdefault('escrituras', []).append(t['id'])
+    contar('escrituras_encoladas')
+    return t['id']
+
+def estado_escritura(id_ticket):
+    # {'hoja', 'estado', 'error'} o None si no existe o ya se olvidó
+    with _cola()['cond']:
+        t = _cola()['tickets'].get(id_ticket)
+        return {'hoja': t['hoja'], 'estado': t['estado'], 'error': t['error']} if t else None
+
+def hojas_en_cola():
+    with _cola()['cond']:
+        return {t['hoja'] for t in _cola()['tickets'].values() if t['estado'] in (EN_COLA, ESCRIBIENDO)}
+
+def esperar_escrituras(ids=None, timeout=120):
+    # Bloquea hasta que esos tickets (o toda la cola) terminen; False si se acabó el tiempo
+    c = _cola()
+    def listas():
+        ts = [c['tickets'][i] for i in ids if i in c['tickets']] if ids is not None else c['tickets'].values()
+        return all(t['estado'] in (ESCRITA, FALLIDA) for t in ts)
+    with c['cond']: return c['cond'].wait_for(listas, timeout)
+
+def _reintentable(e):
+    if isinstance(e, gspread.exceptions.APIError): return e.code == 429 or 500 <= e.code < 600
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+def _esperar_reintento(intento):
+    espera = min(ESPERA_MAX, 2 ** intento); contar('escrituras_reintento')
+    time.sleep(espera / 2 + random.uniform(0, espera / 2))
+
+def _con_reintentos(fn):
+    # Sólo para llamadas que se pueden repetir sin efecto extra (lecturas, batch_update de celdas)
+    for intento in range(REINTENTOS):
+        try: return fn()
+        except Exception as e:
+            if intento == REINTENTOS - 1 or not _reintentable(e): raise
+            _esperar_reintento(intento)
+
+def _agregar_filas(ws, hoja, enc, filas):
+    # append_rows no se puede repetir a ciegas: tras un 5xx, un timeout o un corte las filas pueden haber entrado
+    # igual. Un 429 se reintenta tal cual (la API lo rechaza sin aplicarlo); ante lo demás se leen las columnas
+    # clave y sólo se vuelven a mandar las filas cuya clave todavía no está en la hoja
+    pos = [enc.index(c) for c in CLAVES[hoja]]
+    for intento in range(REINTENTOS):
+        try: return ws.append_rows(filas, value_input_option='RAW', table_range='A1')
+        except Exception as e:
+            if intento == REINTENTOS - 1 or not _reintentable(e): raise
+            _esperar_reintento(intento)
+            if isinstance(e, gspread.exceptions.APIError) and e.code == 429: continue
+            hay = _con_reintentos(lambda: _filas_por_clave(ws, enc, CLAVES[hoja]))
+            filas = [f for f in filas if _clave_normal([f[i] for i in pos]) not in hay]
+            if not filas: return
+
+def _clave_normal(valores):
+    # La misma conversión que al leer (numericise), para comparar una clave de la caché con la de la hoja
+    return tuple(str(gspread.utils.numericise(str(v))) for v in valores)
+
+def _rango_columna(enc, col):
+    l = re.sub(r'\d', '', gspread.utils.rowcol_to_a1(1, enc.index(col) + 1)); return f"{l}:{l}"
+
+def _filas_por_clave(ws, enc, columnas):
+    # {clave: número de fila en la hoja} leyendo sólo las columnas clave; una clave repetida queda en None
+    rangos = ws.batch_get([_rango_columna(enc, c) for c in columnas]); res = {}
+    for fila in range(2, max(map(len, rangos), default=0) + 1):
+        k = _clave_normal([r[fila - 1][0] if len(r) >= fila and r[fila - 1] else "" for r in rangos])
+        if any(k): res[k] = None if k in res else fila
+    return res
+
+def _borrar_filas(ws, hoja, enc, tickets):
+    # Borra las filas con las claves de esos tickets en un solo batch_update (tramos contiguos, de abajo hacia arriba);
+    # devuelve los rechazados. Que estén todas se comprueba una vez: en un reintento, las que ya no están son las
+    # que sí se borraron en el intento anterior
+    filas_hoja = _con_reintentos(lambda: _filas_por_clave(ws, enc, CLAVES[hoja])); rechazados = {}; claves = set()
+    for t in tickets:
+        faltan = sorted({k for k in t['borrar'] if not filas_hoja.get(_clave_normal(k))})
+        if faltan: rechazados[t['id']] = f"Fila no encontrada en la hoja (borrada, editada o repetida): {', '.join('/'.join(k) for k in faltan)}"
+        else: claves |= {_clave_normal(k) for k in t['borrar']}
+    for intento in range(REINTENTOS):
+        tramos = []
+        for f in sorted(f for k, f in filas_hoja.items() if k in claves and f):
+            if tramos and tramos[-1][1] == f: tramos[-1][1] = f + 1
+            else: tramos.append([f, f + 1])
+        if not tramos: break
+        try:
+            ws.spreadsheet.batch_update({'requests': [{'deleteDimension': {'range': {'sheetId': ws.id, 'dimension': 'ROWS', 'startIndex': a - 1,
+                                                                                     'endIndex': b - 1}}} for a, b in reversed(tramos)]})
+            break
+        except Exception as e:
+            if intento == REINTENTOS - 1 or not _reintentable(e): raise
+            _esperar_reintento(intento)
+            filas_hoja = _con_reintentos(lambda: _filas_por_clave(ws, enc, CLAVES[hoja]))
+    return rechazados
+
+def _escribir_lote(hoja, tickets):
+    # Escribe el lote; devuelve {ID de ticket: motivo} de los cambios rechazados porque su fila no se encontró
+    nuevos = [t['agregar'] for t in tickets if t['agregar'] is not None and len(t['agregar'])]
+    con_celdas = [t for t in tickets if t['celdas']]; con_borrar = [t for t in tickets if t['borrar']]; rechazados = {}
+    columnas = list(dict.fromkeys([c for df in nuevos for c in df.columns] + [c for t in con_celdas for _, c in t['celdas']] +
+                                  (CLAVES[hoja] if nuevos or con_celdas or con_borrar else [])))
+    ws = _con_reintentos(lambda: _hoja(hoja)); enc = _con_reintentos(lambda: _encabezado(ws, columnas))
+    if nuevos:  # primero las filas nuevas: puede haber celdas que apunten a ellas
+        filas = [[_a_celda(r.get(c, "")) for c in enc] for df in nuevos for r in df.to_dict('records')]
+        _agregar_filas(ws, hoja, enc, filas)
+    if con_celdas:  # la fila de cada celda es la que hoy tiene su clave en la hoja, no su posición en la caché
+        filas_hoja = _con_reintentos(lambda: _filas_por_clave(ws, enc, CLAVES[hoja])); celdas = {}
+        for t in con_celdas:
+            faltan = sorted({k for k, _ in t['celdas'] if not filas_hoja.get(_clave_normal(k))})
+            if faltan: rechazados[t['id']] = f"Fila no encontrada en la hoja (borrada, editada o repetida): {', '.join('/'.join(k) for k in faltan)}"
+            else: celdas.update(t['celdas'])
+        datos = [{'range': gspread.utils.rowcol_to_a1(filas_hoja[_clave_normal(k)], enc.index(c) + 1), 'values': [[v]]}
+                 for (k, c), v in celdas.items()]
+        if datos: _con_reintentos(lambda: ws.batch_update(datos, value_input_option='RAW'))
+    if con_borrar:  # al último: borrar corre las filas que las celdas de arriba ya ubicaron
+        rechazados.update(_borrar_filas(ws, hoja, enc, con_borrar))
+    return rechazados
+
+def _trabajador_escrituras(c):
+    while True:
+        with c['cond']: c['cond'].wait_for(lambda: c['pendientes'])
+        time.sleep(VENTANA_ESCRITURA)  # junta lo que llegue mientras tanto en un solo lote
+        with c['cond']:
+            lote, c['pendientes'] = c['pendientes'], []
+            for t in lote: t['estado'] = ESCRIBIENDO
+        por_hoja = {}
+        for t in lote: por_hoja.setdefault(t['hoja'], []).append(t)
+        for hoja, tickets in por_hoja.items():
+            try:
+                with medir('escritura_lote', hoja=hoja, cambios=len(tickets)): rechazados = _escribir_lote(hoja, tickets)
+                estado, error = ESCRITA, None; contar('escrituras_lote')
+            except Exception as e:
+                rechazados = {}; estado, error = FALLIDA, str(e); contar('escrituras_error'); invalidar_tabla(hoja)
+                log_perf.warning(json.dumps({'escritura_fallida': hoja, 'cambios': len(tickets), 'error': error}, ensure_ascii=False))
+            if rechazados:
+                contar('escrituras_rechazadas', len(rechazados)); invalidar_tabla(hoja)
+                log_perf.warning(json.dumps({'escritura_rechazada': hoja, 'cambios': len(rechazados), 'error': list(rechazados.values())}, ensure_ascii=False))
+            with c['cond']:
+                for t in tickets:
+                    t['estado'], t['error'] = (FALLIDA, rechazados[t['id']]) if t['id'] in rechazados else (estado, error)
+                    t['agregar'] = None; t['celdas'] = {}; t['borrar'] = []
+                c['cond'].notify_all()
+
+# --- ALMACENAMIENTO (Google Sheets o SQLite) ---
+# Todo pasa por almacen(). Ambos backends cumplen el mismo contrato: leer/agregar/actualizar/
+# reemplazar/borrar/buscar/transaccion, DataFrames de texto y el índice de cada fila es su posición en la tabla.
+class AlmacenSheets:
+    nombre = "Google Sheets"; transaccional = False
+
+    def leer(self, hojas):
+        # Si el batchGet falla se lee pestaña por pestaña; si eso también falla el error sigue hacia quien leyó
+        try:
+            resp = _conexion()['libro'].values_batch_get([f"'{h}'" for h in hojas])
+            rangos = resp.get('valueRanges', [])
+            if len(rangos) != len(hojas): raise ValueError(f"batchGet devolvió {len(rangos)} de {len(hojas)} pestañas")
+        except Exception: return {h: self._leer_hoja(h, c) for h, c in hojas.items()}
+        res = {}
+        for (h, c), r in zip(hojas.items(), rangos):
+            if not r.get('values'):
+                try: _hoja(h).append_row(c)
+                except: pass
+            res[h] = _valores_a_df(r.get('values', []), c)
+        return res
+
+    def _leer_hoja(self, hoja, columnas_obligatorias):
+        ws = _hoja(hoja)
+        valores = ws.get_all_values()
+
+        if not valores:
+            try: ws.append_row(columnas_obligatorias)
+            except: pass
+        return _valores_a_df(valores, columnas_obligatorias)
+
+    def agregar(self, hoja, df_nuevo):
+        # Va a la cola de escritura (append_rows por lotes); devuelve el ticket
+        return encolar_escritura(hoja, agregar=df_nuevo.copy())
+
+    def actualizar(self, hoja, df, indices, columnas, claves):
+        # Cada celda va con la clave de su fila: la cola busca la fila real en la hoja al escribir
+        return encolar_escritura(hoja, celdas={(claves[i], c): _a_celda(df.at[i, c]) for i in indices for c in columnas})
+
+    def reemplazar(self, hoja, df):
+        esperar_escrituras()  # lo encolado antes se escribe primero; si no, caería sobre la hoja nueva
+        valores = [df.columns.values.tolist()] + [[_a_celda(v) for v in fila] for fila in df.values.tolist()]
+        ws = _con_reintentos(lambda: _hoja(hoja)); _con_reintentos(ws.clear); _con_reintentos(lambda: ws.update(valores))
+
+    def borrar(self, hoja, claves):
+        # Va a la cola: el hilo de escritura busca cada clave en la hoja y borra esas filas
+        return encolar_escritura(hoja, borrar=list(claves))
+
+    def buscar(self, hoja, columnas_obligatorias, filtros): return None
+
+    def completar_ids(self, hoja, df, ids):
+        # ids = {índice en df: ID nuevo}. Antes de escribir se comprueba en la hoja que cada fila sigue ahí (mismo DNI)
+        # y sin ID; si alguna no coincide (la hoja cambió mientras tanto) no se escribe nada
+        ws = _hoja(hoja); enc = _con_reintentos(lambda: _encabezado(ws, ['ID', 'DNI'])); c_id = enc.index('ID') + 1
+        col_id, col_dni = _con_reintentos(lambda: ws.batch_get([_rango_columna(enc, 'ID'), _rango_columna(enc, 'DNI')]))
+        celda = lambda col, i: col[i + 1][0] if len(col) > i + 1 and col[i + 1] else ""
+        if any(celda(col_id, i) != "" or _clave_normal([celda(col_dni, i)]) != _clave_normal([df.at[i, 'DNI']]) for i in ids):
+            raise RuntimeError(f"La hoja '{hoja}' cambió mientras se asignaban IDs a los pagos antiguos")
+        _con_reintentos(lambda: ws.batch_update([{'range': gspread.utils.rowcol_to_a1(i + 2, c_id), 'values': [[v]]} for i, v in ids.items()],
+                                                value_input_option='RAW'))
+
+    def transaccion(self): return contextlib.nullcontext()
+
+def _q(nombre): return '"' + str(nombre).replace('"', '""') + '"'
+
+def _texto(v): return str(_a_celda(v))
+
+class AlmacenSQLite:
+    nombre = "SQLite"; transaccional = True
+    INDICES = {TAB_USUARIOS: [('DNI',)], TAB_GRUPOS: [('NombreGrupo',)],
+               TAB_MIEMBROS: [('DNI_Usuario',), ('NombreGrupo', 'DNI_Usuario')],
+               TAB_PAGOS: [('DNI', 'Grupo'), ('Grupo', 'Estado'), ('Estado',)]}
+
+    def __init__(self, ruta):
+        self.ruta = ruta; self.lock = threading.RLock(); self._nivel = 0
+        self.con = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        for hoja, cols in _TABLAS.items(): self._asegurar_columnas(hoja, cols)
+
+    def _asegurar_columnas(self, hoja, columnas):
+        # Crea la tabla (todo TEXT, como en la hoja), agrega columnas nuevas y sus índices
+        with self.lock:
+            existentes = [r[1] for r in self.con.execute(f"PRAGMA table_info({_q(hoja)})")]
+            if not existentes:
+                defs = ", ".join(f"{_q(c)} TEXT NOT NULL DEFAULT ''" for c in columnas)
+                self.con.execute(f"CREATE TABLE {_q(hoja)} ({defs})"); existentes = list(columnas)
+            for c in columnas:
+                if c not in existentes:
+                    self.con.execute(f"ALTER TABLE {_q(hoja)} ADD COLUMN {_q(c)} TEXT NOT NULL DEFAULT ''"); existentes.append(c)
+            for cols in self.INDICES.get(hoja, []):
+                if all(c in existentes for c in cols):
+                    self.con.execute(f"CREATE INDEX IF NOT EXISTS {_q('ix_' + hoja + '_' + '_'.join(cols))} ON {_q(hoja)} ({', '.join(map(_q, cols))})")
+
+    @contextlib.contextmanager
+    def transaccion(self):
+        # Anidable: sólo la más externa abre (BEGIN IMMEDIATE) y confirma o deshace
+        with self.lock:
+            externa = self._nivel == 0
+            if externa: self.con.execute("BEGIN IMMEDIATE")
+            self._nivel += 1
+            try: yield
+            except BaseException:
+                self._nivel -= 1
+                if externa: self.con.execute("ROLLBACK")
+                raise
+            self._nivel -= 1
+            if externa: self.con.execute("COMMIT")
+
+    def leer(self, hojas):
+        res = {}
+        with self.lock:
+            for h, cols in hojas.items():
+                self._asegurar_columnas(h, cols)
+                res[h] = pd.read_sql_query(f"SELECT * FROM {_q(h)} ORDER BY rowid", self.con).astype(str)
+        return res
+
+    def agregar(self, hoja, df_nuevo):
+        cols = list(df_nuevo.columns)
+        with self.transaccion():
+            self._asegurar_columnas(hoja, cols)
+            self.con.executemany(f"INSERT INTO {_q(hoja)} ({', '.join(map(_q, cols))}) VALUES ({', '.join('?' * len(cols))})",
+                                 [[_texto(v) for v in fila] for fila in df_nuevo.itertuples(index=False)])
+
+    def actualizar(self, hoja, df, indices, columnas, claves):
+        # rowid = índice + 1 (las filas sólo se agregan y reemplazar() las renumera desde 1), pero sólo si la fila
+        # sigue teniendo la clave de la caché; si alguna no coincide no se escribe nada
+        with self.transaccion():
+            self._asegurar_columnas(hoja, list(columnas) + CLAVES[hoja])
+            sets = ", ".join(f"{_q(c)} = ?" for c in columnas); donde = " AND ".join(f"{_q(c)} = ?" for c in CLAVES[hoja])
+            n = self.con.executemany(f"UPDATE {_q(hoja)} SET {sets} WHERE rowid = ? AND {donde}",
+                                     [[_texto(df.at[i, c]) for c in columnas] + [int(i) + 1] + list(claves[i]) for i in indices]).rowcount
+            if n != len(indices): raise KeyError(f"Filas de '{hoja}' que cambiaron desde la última lectura: vuelve a cargar la página")
+
+    def reemplazar(self, hoja, df):
+        cols = list(df.columns)
+        with self.transaccion():
+            self._asegurar_columnas(hoja, cols)
+            self.con.execute(f"DELETE FROM {_q(hoja)}")
+            self.con.executemany(f"INSERT INTO {_q(hoja)} (rowid, {', '.join(map(_q, cols))}) VALUES (?, {', '.join('?' * len(cols))})",
+                                 [[n] + [_texto(v) for v in fila] for n, fila in enumerate(df.itertuples(index=False), start=1)])
+
+    def borrar(self, hoja, claves):
+        # rowid tiene que seguir siendo índice + 1: se reescribe la tabla sin esas filas. Cada clave tiene que estar
+        # una sola vez; si no, no se borra nada
+        with self.transaccion():
+            df = self.leer({hoja: _TABLAS[hoja]})[hoja]; filas = list(zip(*(df[c] for c in CLAVES[hoja])))
+            cuantas = Counter(filas); faltan = sorted({k for k in claves if cuantas[k] != 1})
+            if faltan: raise KeyError(f"Filas de '{hoja}' no encontradas (o repetidas): {', '.join('/'.join(k) for k in faltan)}")
+            claves = set(claves); self.reemplazar(hoja, df[[k not in claves for k in filas]])
+
+    def completar_ids(self, hoja, df, ids):
+        # Sólo filas que siguen sin ID; si alguna ya no calza se deshace todo
+        with self.transaccion():
+            n = self.con.executemany(f"UPDATE {_q(hoja)} SET {_q('ID')} = ? WHERE rowid = ? AND {_q('ID')} = ''",
+                                     [[v, int(i) + 1] for i, v in ids.items()]).rowcount
+            if n != len(ids): raise RuntimeError(f"La tabla '{hoja}' cambió mientras se asignaban IDs a los pagos antiguos")
+
+    def buscar(self, hoja, columnas_obligatorias, filtros):
+        where = " AND ".join(f"{_q(c)} = ?" for c in filtros) or "1"
+        with self.lock:
+            self._asegurar_columnas(hoja, columnas_obligatorias)
+            df = pd.read_sql_query(f"SELECT rowid - 1 AS _fila, * FROM {_q(hoja)} WHERE {where} ORDER BY rowid",
+                                   self.con, params=[str(v) for v in filtros.values()])
+        return aplicar_esquema(hoja, df.set_index('_fila').rename_axis(None).astype(str))[0]
+
+@st.cache_resource(show_spinner=False)
+def almacen():
+    # SQLite si hay ruta en PANDERO_SQLITE o en secrets ([almacen] sqlite = "pandero.db"); si no, Google Sheets
+    ruta = os.environ.get("PANDERO_SQLITE")
+    if not ruta:
+        try: ruta = st.secrets["almacen"]["sqlite"]
+        except: ruta = None
+    return AlmacenSQLite(ruta) if ruta else AlmacenSheets()
+
+def copiar_almacen(origen, destino):
+    # Importa/exporta las cuatro tablas completas con el mismo formato de columnas que las hojas
+    esperar_escrituras(); datos = origen.leer(_TABLAS)
+    with destino.transaccion():
+        for h, df in datos.items(): destino.reemplazar(h, df)
+    for h in datos: invalidar_tabla(h)
+    return {h: len(df) for h, df in datos.items()}
+
+# --- OPERACIONES CON TRANSACCIÓN ---
+# True si se escribió, False si ya existía. Si la escritura falla la transacción se deshace y la excepción
+# sigue hacia la pantalla (que muestra el error en lugar de un falso "listo").
+def registrar_usuario(nombre, dni, celular):
+    try:
+        with almacen().transaccion():
+            if not buscar_df(TAB_USUARIOS, COLS_USUARIOS, DNI=dni).empty: return False
+            _agregar(TAB_USUARIOS, pd.DataFrame([{"Nombre": nombre, "DNI": dni, "Celular": celular}]))
+    except Exception: invalidar_tabla(TAB_USUARIOS); raise
+    return True
+
+def inscribir_miembro(grupo, dni, turno, tipo):
+    try:
+        with almacen().transaccion():
+            if not buscar_df(TAB_MIEMBROS, COLS_MIEMBROS, NombreGrupo=grupo, DNI_Usuario=dni).empty: return False
+            _agregar(TAB_MIEMBROS, pd.DataFrame([{"NombreGrupo": grupo, "DNI_Usuario": dni, "Turno": turno, "Tipo": tipo}]))
+    except Exception: invalidar_tabla(TAB_MIEMBROS); raise
+    return True
+
+def actualizar_pagos(ids, columna, valor):
+    # Cambia una columna de varios pagos por ID con una sola escritura; el índice ID -> fila evita recorrer la tabla
+    indice = indice_tabla(TAB_PAGOS, COLS_PAGOS, 'ID')
+    filas = [indice[i] for i in ids if i in indice]
+    if filas:
+        with almacen().transaccion():
+            actualizar_df(TAB_PAGOS, pd.DataFrame({columna: valor}, index=filas), filas, [columna])
+    return len(filas)
+
+def cambiar_estado_pagos(ids, estado): return actualizar_pagos(ids, 'Estado', estado)
+
+# --- VOUCHERS: SUBIDA EN SEGUNDO PLANO Y MINIATURAS ---
+FOTO_SUBIENDO = "Subiendo"; FOTO_ERROR = "ErrorSubida"
+
+@st.cache_resource(show_spinner=False)
+def _subidas():
+    # Pool compartido por todas las sesiones; 'trabajos' = {ID de pago: Future con la URL final}
+    return {'pool': ThreadPoolExecutor(max_workers=4, thread_name_prefix="voucher"), 'trabajos': {}}
+
+def comprimir_imagen(datos, lado_max=1600, calidad=80):
+    # La foto del celular se achica y se recomprime a JPEG antes de subirla
+    try:
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(datos)))
+        img.thumbnail((lado_max, lado_max))
+        if img.mode != "RGB": img = img.convert("RGB")
+        buf = io.BytesIO(); img.save(buf, "JPEG", quality=calidad, optimize=True)
+        return buf.getvalue() if buf.tell() < len(datos) else datos
+    except Exception: return datos  # no es una imagen que Pillow entienda (PDF, HEIC...): va tal cual
+
+def _subir_voucher(id_pago, datos, carpeta, nombre):
+    try:
+        with medir('cloudinary_upload', bytes=len(datos)):
+            url = cloudinary.uploader.upload(comprimir_imagen(datos), folder=carpeta, public_id=nombre)['secure_url']
+        contar('subidas_ok')
+    except Exception: url = FOTO_ERROR; contar('subidas_error')
+    try:  # corre en el pool: un error aquí no debe llegar a la pantalla del socio (estado_subida lee el resultado)
+        if not actualizar_pagos([id_pago], 'Foto', url): url = FOTO_ERROR
+    except Exception as e:
+        url = FOTO_ERROR; contar('subidas_error'); log_perf.warning(json.dumps({'foto_sin_guardar': id_pago, 'error': str(e)}, ensure_ascii=False))
+    return url
+
+def enviar_voucher(dni, grupo, semana, monto, archivo):
+    # Registra el pago 'Pendiente' de inmediato y deja la subida a Cloudinary al pool. Si el pago no se pudo
+    # registrar el error sigue hacia la pantalla y no se sube nada
+    id_pago = nuevo_id_pago(); ahora = datetime.now()
+    try: _agregar(TAB_PAGOS, pd.DataFrame([{"Fecha":ahora.strftime("%Y-%m-%d"), "DNI":dni, "Grupo":grupo, "Monto":monto, "Estado":"Pendiente", "Foto":FOTO_SUBIENDO, "SemanaPagada":semana, "ID":id_pago}]))
+    except Exception: invalidar_tabla(TAB_PAGOS); raise
+    sub = _subidas()
+    for k in [k for k, f in sub['trabajos'].items() if f.done()][:-200]: sub['trabajos'].pop(k, None)
+    nombre = f"S{semana.split()[1]}_{ahora.strftime('%Y%m%d%H%M%S')}"
+    sub['trabajos'][id_pago] = sub['pool'].submit(_subir_voucher, id_pago, archivo.getvalue(), f"PANDEROS/{dni}/{grupo}", nombre)
+    return id_pago
+
+def estado_subida(id_pago):
+    f = _subidas()['trabajos'].get(id_pago)
+    if f is None or not f.done(): return "subiendo" if f else "desconocido"
+    return "error" if f.result() == FOTO_ERROR else "ok"
+
+def miniatura(url, ancho=320):
+    # Cloudinary genera la miniatura al vuelo a partir de la transformación en la URL
+    return url.replace("/upload/", f"/upload/c_limit,w_{ancho},q_auto,f_auto/", 1) if "/upload/" in url else url
+
+def html_miniatura(url):
+    # <img loading=lazy>: el navegador sólo baja las que se ven; la original se abre al tocarla.
+    # La URL viene de la hoja y va a HTML sin sanitizar (unsafe_allow_html): se escapa con comillas incluidas
+    return (f'<a href="{html.escape(url, quote=True)}" target="_blank"><img src="{html.escape(miniatura(url), quote=True)}" loading="lazy" '
+            f'style="max-width:100%; max-height:240px; border-radius:6px"></a>')
+
+# --- PDF ---
+def crear_reporte_pdf(nombre_grupo, datos_miembros):
+    with medir('reporte_pdf', grupo=nombre_grupo, socios=len(datos_miembros)): return _reporte_pdf(nombre_grupo, datos_miembros)
+
+def _reporte_pdf(nombre_grupo, datos_miembros):
+    class PDF(FPDF):
+        def header(self):
+            self.set_font('Arial', 'B', 15); self.cell(0, 10, f'Reporte: {nombre_grupo}', 0, 1, 'C'); self.ln(5)
+    pdf = PDF(); pdf.add_page(); pdf.set_font("Arial", size=10); pdf.set_fill_color(200, 220, 255)
+    pdf.cell(80, 10, "Socio", 1, 0, 'C', 1); pdf.cell(20, 10, "Turno", 1, 0, 'C', 1)
+    pdf.cell(30, 10, "Pagado", 1, 0, 'C', 1); pdf.cell(30, 10, "Deuda", 1, 0, 'C', 1); pdf.cell(30, 10, "Estado", 1, 1, 'C', 1)
+    for m in datos_miembros:
+        pdf.cell(80, 10, str(m['Nombre']), 1); pdf.cell(20, 10, str(m['Turno']), 1, 0, 'C')
+        pdf.cell(30, 10, f"S/. {m['Pagado']}", 1, 0, 'R'); pdf.cell(30, 10, str(m['Deuda']), 1, 0, 'C')
+        pdf.set_text_color(255, 0, 0) if m['Deuda'] > 0 else pdf.set_text_color(0, 128, 0)
+        pdf.cell(30, 10, "DEUDA" if m['Deuda'] > 0 else "OK", 1, 1, 'C'); pdf.set_text_color(0)
+    return pdf.output(dest='S').encode('latin-1')
+
+# --- LIBRO DEL GRUPO (todos los socios en una sola pasada) ---
+COLS_CALENDARIO = ['DNI', 'Semana', 'Fecha', 'Monto', 'Estado']
+COLS_RESUMEN = ['Turno', 'Tipo', 'Pagado', 'Deuda', 'TotAprobado', 'TotPendiente']
+
+def calcular_libro_grupo(grupo, df_m, df_g, df_p, hoy=None):
+    # Devuelve (calendario, resumen): una fila por socio y semana, y una fila por socio (índice DNI).
+    # Mismas reglas que el calendario individual: base hasta su turno, interés después, 'Medio' paga la mitad.
+    with medir('calendario', grupo=grupo): return _libro_grupo(grupo, df_m, df_g, df_p, hoy)
+
+def _socios_grupo(grupo, df_m, df_g):
+    # (fila del grupo, sus socios) o None si no hay nada que calcular
+    g_idx = df_g[df_g['NombreGrupo'] == grupo]
+    mis_m = df_m[df_m['NombreGrupo'] == grupo]
+    if g_idx.empty or mis_m.empty: return None
+    dat_g = g_idx.iloc[0]
+    if pd.isna(dat_g['FechaInicio']) or pd.isna(dat_g['SemanasDuracion']): return None  # celda inválida, ya reportada al admin
+    return dat_g, mis_m.drop_duplicates('DNI_Usuario')  # como iloc[0]: vale la primera inscripción
+
+def _libro_grupo(grupo, df_m, df_g, df_p, hoy):
+    socios = _socios_grupo(grupo, df_m, df_g)
+    if socios is None: return pd.DataFrame(columns=COLS_CALENDARIO), pd.DataFrame(columns=COLS_RESUMEN)
+    dat_g, mis_m = socios; dnis = mis_m['DNI_Usuario'].to_numpy(); n = len(dnis)
+
+    # Totales por socio: un groupby sobre los pagos del grupo
+    p = df_p[df_p['Grupo'] == grupo]
+    tot = p.groupby([p['DNI'].astype(str), p['Estado'].astype(str)])['Monto'].sum().unstack(fill_value=0) if not p.empty else {}
+    pagado = tot['Aprobado'].reindex(dnis).fillna(0).to_numpy() if 'Aprobado' in tot else np.zeros(n)
+    pendiente = tot['Pendiente'].reindex(dnis).fillna(0).to_numpy() if 'Pendiente' in tot else np.zeros(n)
+    return _matriz_grupo(dat_g, mis_m, pagado, pendiente, hoy)
+
+def _matriz_grupo(dat_g, mis_m, pagado, pendiente, hoy, calendario=True):
+    # Matriz socios x semanas a partir de lo aprobado y pendiente de cada socio
+    inicio = dat_g['FechaInicio'].to_pydatetime(); duracion = int(dat_g['SemanasDuracion'])
+    dnis = mis_m['DNI_Usuario'].to_numpy(); n = len(dnis)
+    turnos = mis_m['Turno'].fillna(0).to_numpy(dtype=int)
+    factor = np.where(mis_m['Tipo'].to_numpy() == 'Medio', 0.5, 1.0)
+    base = (400.0 if pd.isna(dat_g['MontoBase']) else dat_g['MontoBase']) * factor
+    interes = (430.0 if pd.isna(dat_g['MontoInteres']) else dat_g['MontoInteres']) * factor
+
+    hoy = hoy or datetime.now(); semanas = np.arange(1, duracion + 1)
+    fechas = [inicio + timedelta(weeks=i) for i in range(duracion)]
+    monto = np.where((turnos[:, None] > 0) & (semanas[None, :] > turnos[:, None]), interes[:, None], base[:, None])
+    acumulado = monto.cumsum(axis=1); pag = pagado[:, None]; pen = pendiente[:, None]
+    vencida = np.array([f < hoy for f in fechas], dtype=bool)[None, :]
+    estado = np.select([pag >= acumulado, (pag + pen) >= acumulado, (pag >= acumulado - monto) & (pag < acumulado), vencida],
+                       ["green", "orange", "yellow", "red"], default="grey")
+
+    cal = pd.DataFrame({'DNI': np.repeat(dnis, duracion), 'Semana': np.tile(semanas, n),
+                        'Fecha': np.tile([f.strftime("%d/%m") for f in fechas], n), 'Monto': monto.ravel(),
+                        'Estado': estado.ravel()}) if calendario else None
+    resumen = pd.DataFrame({'Turno': mis_m['Turno'].to_numpy(), 'Tipo': mis_m['Tipo'].to_numpy(),
+                            'Pagado': np.where(estado == 'green', monto, 0).sum(axis=1), 'Deuda': (estado == 'red').sum(axis=1),
+                            'TotAprobado': pagado, 'TotPendiente': pendiente}, index=pd.Index(dnis, name='DNI'))
+    return cal, resumen
+
+def generar_calendario_usuario(dni_usuario, nombre_grupo_objetivo=None):
+    datos = cargar_todo(); df_m = datos[TAB_MIEMBROS]; df_g = datos[TAB_GRUPOS]; df_p = datos[TAB_PAGOS]
+    
+    if df_m.empty: return [], "Sin Grupo", "Completo"
+    dni_usuario = str(dni_usuario)
+    
+    # FILTRO: Buscar todos los grupos del usuario o uno específico
+    mis_filas = df_m[df_m['DNI_Usuario'] == dni_usuario]
+    if mis_filas.empty: return [], "Sin Grupo", "Completo"
+    
+    # Si no nos dan un grupo objetivo, tomamos el primero (comportamiento default)
+    # Si nos dan uno, filtramos por ese
+    if nombre_grupo_objetivo:
+        fila_target = mis_filas[mis_filas['NombreGrupo'] == nombre_grupo_objetivo]
+        if fila_target.empty: return [], "No inscrito en este grupo", "Completo"
+        dat_m = fila_target.iloc[0]
+    else:
+        dat_m = mis_filas.iloc[0] # Fallback al primero
+    
+    grupo = dat_m['NombreGrupo']; tipo_p = dat_m.get('Tipo', 'Completo')
+    if df_g[df_g['NombreGrupo'] == grupo].empty: return [], "Grupo Eliminado", "Completo"
+    
+    # El calendario individual es el libro del grupo restringido a este socio
+    cal, _ = calcular_libro_grupo(grupo, mis_filas, df_g, df_p)
+    return cal[['Semana', 'Fecha', 'Monto', 'Estado']].to_dict('records'), grupo, tipo_p
+
+# --- VISTAS (datos listos para las pantallas) ---
+def tabla_calendario(cal):
+    # Calendario para st.dataframe: montos en soles y estados como íconos
+    dfv = pd.DataFrame(cal)[['Semana','Fecha','Monto','Estado']]
+    dfv['Monto'] = dfv['Monto'].apply(lambda x: f"S/. {x:.2f}")
+    dfv['Estado'] = dfv['Estado'].map({'red':'🔴','green':'🟢','grey':'⚪','orange':'🟠','yellow':'🟡'})
+    return dfv
+
+def miembros_grupo(grupo, datos):
+    # Pestaña Miembros: [(fila socio+usuario, calendario)] ordenado por turno, y el resumen del libro
+    df_m = datos[TAB_MIEMBROS]; mis_m = df_m[df_m['NombreGrupo'] == grupo]
+    if mis_m.empty: return [], None
+    mis_m = mis_m.assign(TurnoNum=mis_m['Turno'].fillna(0)).sort_values(by='TurnoNum')
+    dat = pd.merge(mis_m, datos[TAB_USUARIOS], left_on="DNI_Usuario", right_on="DNI")
+    cal_g, res_g = calcular_libro_grupo(grupo, df_m, datos[TAB_GRUPOS], datos[TAB_PAGOS])
+    cal_por_dni = dict(tuple(cal_g.groupby('DNI', sort=False)))
+    return [(r, cal_por_dni[r['DNI']]) for _, r in dat.iterrows() if r['DNI'] in res_g.index], res_g
+
+def reporte_grupo(grupo, datos):
+    # Filas del PDF del grupo: nombre, turno, pagado y semanas en rojo de cada socio
+    df_m = datos[TAB_MIEMBROS]
+    dat = pd.merge(df_m[df_m['NombreGrupo'] == grupo], datos[TAB_USUARIOS], left_on="DNI_Usuario", right_on="DNI")
+    _, res_g = calcular_libro_grupo(grupo, df_m, datos[TAB_GRUPOS], datos[TAB_PAGOS])
+    dat = dat[dat['DNI'].isin(res_g.index)]
+    return [{"Nombre":r['Nombre'], "Turno":r['Turno'], "Pagado":res_g.at[r['DNI'], 'Pagado'], "Deuda":res_g.at[r['DNI'], 'Deuda']}
+            for _, r in dat.iterrows()]
+
+# --- RESUMEN DE GRUPOS (Panel de Control) ---
+# Totales aprobado/pendiente por (grupo, socio, estado) guardados junto a la pestaña de pagos en caché.
+# Se arman una vez por lectura y luego cada pago nuevo o cambio de Estado/Monto los ajusta con su diferencia
+# (desde los parches de la caché). Una relectura de la pestaña los arrastra ajustando sólo las filas distintas, y
+# las matrices por grupo se rehacen cuando cambian los datos (hash) de grupos, socios o usuarios, no en cada
+# relectura. Con esos totales sólo se recalcula la matriz de los grupos tocados.
+COLS_TOTALES = ['Grupo', 'DNI', 'Estado', 'Monto']; ESTADOS_SUMADOS = ['Aprobado', 'Pendiente']
+
+def _sumas_pagos(df):
+    df = df[df['Estado'].astype(str).isin(ESTADOS_SUMADOS)]
+    return df.groupby([df['Grupo'].astype(str), df['DNI'].astype(str), df['Estado'].astype(str)], sort=False)['Monto'].sum()
+
+def _resumen_pagos(e, antes, despues):
+    # Llamada con el lock de la caché tomado; si el resumen aún no se armó no hay nada que ajustar
+    r = e.get('resumen')
+    if r is None: return
+    for df, signo in ((antes, -1), (despues, 1)):
+        if df is None or df.empty: continue
+        for k, m in _sumas_pagos(df).items():
+            r['totales'][k] = round(r['totales'].get(k, 0) + signo * (0 if pd.isna(m) else m), 2); r['sucios'].add(k[0])
+
+def _arrastrar_resumen(previa, e):
+    # Relectura de pagos: los totales pasan a la entrada nueva ajustados sólo por las filas que cambiaron
+    # (un hash por fila de COLS_TOTALES, contando repetidas), sin volver a agrupar la tabla entera
+    e['resumen'] = previa['resumen']
+    viejo, nuevo = previa['df'][COLS_TOTALES], e['df'][COLS_TOTALES]
+    hv, hn = pd.util.hash_pandas_object(viejo, index=False), pd.util.hash_pandas_object(nuevo, index=False)
+    dif = hn.value_counts().sub(hv.value_counts(), fill_value=0); dif = dif[dif != 0]
+    if dif.empty: return
+    filas = pd.concat([nuevo.set_axis(hn.to_numpy()), viejo.set_axis(hv.to_numpy())])
+    filas = filas[~filas.index.duplicated()].loc[dif.index]
+    _resumen_pagos(e, None, filas.assign(Monto=filas['Monto'].to_numpy() * dif.to_numpy()))
+    contar('resumen_filas_releidas', len(dif))
+
+def resumen_grupos():
+    # (una fila por grupo, una fila por socio) para el Panel de Control
+    datos = cargar_todo(); c = _cache_tablas()
+    with c['lock']:
+        e = c['tablas'][TAB_PAGOS]; r = e.get('resumen')
+        if r is None:
+            r = e['resumen'] = {'totales': {k: round(m, 2) for k, m in _sumas_pagos(e['df']).items()}, 'sucios': set(),
+                                'clave': None, 'grupos': {}, 'socios': {}}
+        clave = (huella_tabla(TAB_GRUPOS), huella_tabla(TAB_MIEMBROS), huella_tabla(TAB_USUARIOS), datetime.now().date())
+        todos = datos[TAB_GRUPOS]['NombreGrupo'].dropna().astype(str).unique().tolist()
+        if r['clave'] != clave: r['clave'] = clave; r['grupos'].clear(); r['socios'].clear()
+        recalcular = [g for g in todos if g in r['sucios'] or g not in r['grupos']]
+        with medir('resumen_grupos', grupos=len(todos), recalculados=len(recalcular)):
+            nombres = dict(zip(datos[TAB_USUARIOS]['DNI'].astype(str), datos[TAB_USUARIOS]['Nombre']))
+            for g in recalcular: r['grupos'][g], r['socios'][g] = _resumen_grupo(g, datos, r['totales'], nombres)
+        r['sucios'].clear()
+        filas_g = [r['grupos'][g] for g in todos]; socios = [r['socios'][g] for g in todos if not r['socios'][g].empty]
+    return pd.DataFrame(filas_g), (pd.concat(socios, ignore_index=True) if socios else pd.DataFrame())
+
+def _resumen_grupo(grupo, datos, totales, nombres):
+    fila = {'Grupo': grupo, 'Semana': "-", 'Turno de': "-", 'Socios': 0, 'Recaudado': 0.0, 'Pendiente': 0.0,
+            'Con deuda': 0, 'Semanas en rojo': 0}
+    socios = _socios_grupo(grupo, datos[TAB_MIEMBROS], datos[TAB_GRUPOS])
+    if socios is None: return fila, pd.DataFrame()
+    dat_g, mis_m = socios; dnis = mis_m['DNI_Usuario'].astype(str).to_numpy()
+    pagado = np.array([totales.get((grupo, d, 'Aprobado'), 0) for d in dnis], dtype=float)
+    pendiente = np.array([totales.get((grupo, d, 'Pendiente'), 0) for d in dnis], dtype=float)
+    _, res = _matriz_grupo(dat_g, mis_m, pagado, pendiente, None, calendario=False)
+
+    # Semana en curso y a quién le toca cobrar
+    semana = (datetime.now() - dat_g['FechaInicio'].to_pydatetime()).days // 7 + 1; duracion = int(dat_g['SemanasDuracion'])
+    if semana < 1: fila['Semana'] = "Por iniciar"
+    elif semana > duracion: fila['Semana'] = "Terminado"
+    else:
+        fila['Semana'] = f"{semana}/{duracion}"
+        cobra = res.index[pd.to_numeric(res['Turno'], errors='coerce').fillna(0) == semana]
+        fila['Turno de'] = ", ".join(nombres.get(d, d) for d in cobra) or "-"
+    fila.update({'Socios': len(res), 'Recaudado': float(res['TotAprobado'].sum()), 'Pendiente': float(res['TotPendiente'].sum()),
+                 'Con deuda': int((res['Deuda'] > 0).sum()), 'Semanas en rojo': int(res['Deuda'].sum())})
+    socios = res.reset_index()[['DNI', 'Turno', 'Tipo', 'TotAprobado', 'TotPendiente', 'Deuda']]
+    socios.insert(0, 'Grupo', grupo); socios.insert(2, 'Nombre', socios['DNI'].map(lambda d: nombres.get(d, "")))
+    return fila, socios
+
+# --- REPORTES EN LOTE (todos los grupos, en paralelo y con caché) ---
+# Cada PDF se guarda bajo un hash de las filas que lo producen (grupo, socios, sus usuarios y sus pagos) más
+# la fecha de hoy, porque la deuda depende del día. Los que faltan se generan en un pool de procesos (spawn):
+# a cada proceso sólo viajan las filas de su grupo.
+TRABAJADORES_PDF = min(4, os.cpu_count() or 1); MAX_PDFS_CACHE = 1000
+
+@st.cache_resource(show_spinner=False)
+def _cache_pdfs():
+    return {'pdfs': {}, 'lock': threading.Lock()}
+
+@st.cache_resource(show_spinner=False)
+def _pool_pdf():
+    return ProcessPoolExecutor(max_workers=TRABAJADORES_PDF, mp_context=multiprocessing.get_context("spawn"))
+
+def _datos_por_grupo(datos, grupos):
+    # {grupo: {pestaña: sólo sus filas}} con un groupby por pestaña en vez de un filtro por grupo
+    por = {t: dict(tuple(datos[t].groupby(datos[t][col].astype(str), sort=False)))
+           for t, col in ((TAB_GRUPOS, 'NombreGrupo'), (TAB_MIEMBROS, 'NombreGrupo'), (TAB_PAGOS, 'Grupo'))}
+    df_u = datos[TAB_USUARIOS]; res = {}
+    for g in grupos:
+        sub = {t: por[t].get(g, datos[t].iloc[:0]) for t in por}
+        sub[TAB_USUARIOS] = df_u[df_u['DNI'].isin(sub[TAB_MIEMBROS]['DNI_Usuario'])]
+        res[g] = sub
+    return res
+
+def _clave_reporte(grupo, sub):
+    h = hashlib.sha256(f"{grupo}|{datetime.now():%Y-%m-%d}".encode())
+    for t in (TAB_GRUPOS, TAB_MIEMBROS, TAB_USUARIOS, TAB_PAGOS):
+        h.update(pd.util.hash_pandas_object(sub[t], index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def _pdf_de_grupo(grupo, sub):
+    # Corre dentro del pool de procesos: todo lo que necesita viene en sub
+    return crear_reporte_pdf(grupo, reporte_grupo(grupo, sub))
+
+def _generar_pdfs(grupos, subs):
+    # Con pocos grupos (o una sola CPU) no vale la pena mandar trabajo a otros procesos
+    if len(grupos) < 3 or TRABAJADORES_PDF < 2: return {g: _pdf_de_grupo(g, subs[g]) for g in grupos}
+    try:
+        lote = max(1, len(grupos) // (TRABAJADORES_PDF * 4))
+        return dict(zip(grupos, _pool_pdf().map(_pdf_de_grupo, grupos, [subs[g] for g in grupos], chunksize=lote)))
+    except BrokenProcessPool:
+        _pool_pdf.clear()  # un proceso murió: se rehace el pool la próxima vez y esta vez se generan aquí
+        return {g: _pdf_de_grupo(g, subs[g]) for g in grupos}
+
+def reportes_pdf(datos, grupos=None):
+    # {grupo: bytes del PDF}; sólo se generan los grupos cuyos datos cambiaron desde la última vez
+    if grupos is None: grupos = datos[TAB_GRUPOS]['NombreGrupo'].dropna().astype(str).unique().tolist()
+    subs = _datos_por_grupo(datos, grupos); claves = {g: _clave_reporte(g, subs[g]) for g in grupos}
+    c = _cache_pdfs()
+    with c['lock']: res = {g: c['pdfs'][k] for g, k in claves.items() if k in c['pdfs']}
+    faltan = [g for g in grupos if g not in res]
+    contar('pdf_cache_hit', len(res)); contar('pdf_generado', len(faltan))
+    with medir('reportes_pdf', grupos=len(grupos), generados=len(faltan)):
+        res.update(_generar_pdfs(faltan, subs))
+    with c['lock']:
+        for g in faltan: c['pdfs'][claves[g]] = res[g]
+        for k in list(c['pdfs'])[:-MAX_PDFS_CACHE]: c['pdfs'].pop(k)
+    return {g: res[g] for g in grupos}
+
+def pdf_grupo(grupo, datos): return reportes_pdf(datos, [grupo])[grupo]
+
+def nombre_archivo(texto): return re.sub(r'[^\w\-]+', '_', str(texto)).strip('_') or "grupo"
+
+def zip_reportes(datos):
+    # Un PDF por grupo dentro de un ZIP
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        for g, pdf in reportes_pdf(datos).items(): z.writestr(f"Reporte_{nombre_archivo(g)}.pdf", pdf)
+    return buf.getvalue()
+
+# --- ARCHIVO (grupos terminados en Parquet) ---
+# Los grupos cuya última semana ya pasó y que quedaron saldados (todo pagado y validado) se mueven de las tablas vivas a un archivo
+# Parquet por grupo y por tabla: <archivo>/<tabla>/<grupo>-<inicio>-<hash>.parquet. Así cargar_todo() sólo trae
+# lo activo y el historial se lee recién cuando se pide. Un nombre de grupo se puede volver a usar, así que cada
+# grupo archivado es (NombreGrupo, FechaInicio): las filas de miembros y pagos llevan también su FechaInicio, y
+# nunca se pisa un archivo que ya existe. Se guardan los textos tal cual están en la base (sin perder celdas
+# inválidas) y el esquema se aplica al leer. La carpeta tiene que ser persistente: se configura con
+# PANDERO_ARCHIVO o en secrets ([almacen] archivo = "/ruta"); sin ella no se archiva nada.
+_TABLAS_ARCHIVO = {TAB_GRUPOS: 'NombreGrupo', TAB_MIEMBROS: 'NombreGrupo', TAB_PAGOS: 'Grupo'}
+
+def ruta_archivo():
+    ruta = os.environ.get("PANDERO_ARCHIVO")
+    if not ruta:
+        try: ruta = st.secrets["almacen"]["archivo"]
+        except: ruta = None
+    return ruta
+
+def _parquet_de(tabla, grupo, inicio):
+    g = f"{grupo}|{inicio}"
+    return os.path.join(ruta_archivo(), tabla, f"{nombre_archivo(grupo)}-{inicio}-{hashlib.sha1(g.encode()).hexdigest()[:8]}.parquet")
+
+def archivables(datos, hoy=None):
+    # Grupos terminados sin pagos 'Pendiente' y con todas las semanas de todos los socios en verde: uno con deudores
+    # se queda en las tablas vivas, que es donde se pueden registrar los pagos atrasados
+    df_g = datos[TAB_GRUPOS].dropna(subset=['FechaInicio', 'SemanasDuracion'])
+    fin = df_g['FechaInicio'] + pd.to_timedelta(df_g['SemanasDuracion'].astype(int) * 7, unit='D')
+    terminados = df_g.loc[fin < (hoy or datetime.now()), 'NombreGrupo'].astype(str)
+    con_pendientes = set(buscar_df(TAB_PAGOS, COLS_PAGOS, Estado='Pendiente')['Grupo'].astype(str))
+    saldado = lambda g: (calcular_libro_grupo(g, datos[TAB_MIEMBROS], datos[TAB_GRUPOS], datos[TAB_PAGOS], hoy)[0]['Estado'] == 'green').all()
+    return [g for g in terminados if g not in con_pendientes and saldado(g)]
+
+def archivar_grupos(grupos):
+    # Escribe los Parquet y recién entonces borra esas filas de las tablas vivas, ubicadas por su clave: lo que otra
+    # sesión escriba mientras tanto queda en la tabla -> {tabla: filas archivadas}. Si algo falla, primero las tablas
+    # vuelven a como estaban (SQLite deshace la transacción; en Sheets se vuelven a agregar las filas ya borradas) y
+    # sólo entonces se borran los Parquet nuevos; si no se pudo restaurar, se quedan (son la única copia de esas
+    # filas). El error sigue hacia quien llamó
+    if not ruta_archivo() or not grupos: return {}
+    grupos = {str(g) for g in grupos}; esperar_escrituras(); res = {}; escritos = []; salen = {}; tickets = {}
+    try:
+        with medir('archivar_grupos', grupos=len(grupos)), almacen().transaccion():
+            crudo = almacen().leer({t: _TABLAS[t] for t in _TABLAS_ARCHIVO})  # texto tal cual está en la base
+            _completar_ids(crudo[TAB_PAGOS])  # sin ID un pago no se puede ubicar para borrarlo
+            df_g = crudo[TAB_GRUPOS]
+            inicios = {g: str(f).split(" ")[0] for g, f in zip(df_g['NombreGrupo'].astype(str), df_g['FechaInicio']) if g in grupos}
+            ya = [f"{g} ({i})" for g, i in inicios.items() if any(os.path.exists(_parquet_de(t, g, i)) for t in _TABLAS_ARCHIVO)]
+            if ya: raise FileExistsError(f"Ya hay un archivo para {', '.join(ya)}: no se archiva para no pisarlo")
+            for t, col in _TABLAS_ARCHIVO.items():
+                df = crudo[t]; sale = df[col].astype(str).isin(inicios); salen[t] = df[sale]
+                for g, parte in df[sale].groupby(df.loc[sale, col].astype(str)):
+                    destino = _parquet_de(t, g, inicios[g]); os.makedirs(os.path.dirname(destino), exist_ok=True)
+                    tmp = os.path.join(os.path.dirname(destino), "." + os.path.basename(destino) + ".tmp")  # los ocultos no se leen
+                    parte = parte.reset_index(drop=True)
+                    if t != TAB_GRUPOS: parte['FechaInicio'] = inicios[g]
+                    parte.to_parquet(tmp, compression="zstd", index=False); os.replace(tmp, destino); escritos.append(destino)
+                res[t] = int(sale.sum())
+            for t in _TABLAS_ARCHIVO:
+                if res[t]: tickets[t] = _borrar(t, salen[t])
+            if not almacen().transaccional:  # Sheets: el borrado va por la cola, hay que ver que de verdad se hizo
+                esperar_escrituras(list(tickets.values()))
+                fallas = [(estado_escritura(i) or {}).get('error') or "sin terminar" for i in tickets.values()
+                          if (estado_escritura(i) or {}).get('estado') != ESCRITA]
+                if fallas: raise RuntimeError(f"No se pudieron borrar las filas archivadas: {'; '.join(fallas)}")
+    except Exception:
+        restauradas = True
+        if not almacen().transaccional and tickets:
+            try: restauradas = _restaurar_borrado(salen, tickets)
+            except Exception as e: restauradas = False; log_perf.error(json.dumps({'archivo_sin_restaurar': list(tickets), 'error': str(e)}, ensure_ascii=False))
+        if restauradas:
+            for d in escritos:
+                with contextlib.suppress(OSError): os.remove(d)
+        else: log_perf.error(json.dumps({'archivo_conservado': escritos}, ensure_ascii=False))
+        for t in _TABLAS_ARCHIVO: invalidar_tabla(t)
+        raise
+    return res
+
+def _restaurar_borrado(salen, tickets):
+    # Sheets: vuelve a agregar las filas archivadas que ya no están en la hoja; True si todo quedó como antes.
+    # Mientras un borrado siga en la cola no se sabe qué se borró, y no se toca nada
+    if not esperar_escrituras(list(tickets.values())): return False
+    ids = []
+    for t in tickets:
+        ws = _con_reintentos(lambda: _hoja(t)); enc = _con_reintentos(lambda: _encabezado(ws, CLAVES[t]))
+        hay = _con_reintentos(lambda: _filas_por_clave(ws, enc, CLAVES[t]))
+        falta = salen[t][[_clave_normal(k) not in hay for k in salen[t][CLAVES[t]].itertuples(index=False)]]
+        if len(falta): ids.append(_agregar(t, falta))
+    return esperar_escrituras(ids) and all((estado_escritura(i) or {}).get('estado') == ESCRITA for i in ids)
+
+def _leer_parquet(tabla, origen, filtros=None):
+    df = pd.read_parquet(origen, filters=filtros or None)
+    for col in _TABLAS[tabla]:
+        if col not in df.columns: df[col] = ""
+    return aplicar_esquema(tabla, df)[0]
+
+def leer_archivo(tabla, **filtros):
+    # Filas archivadas de una tabla (ya con esquema); los filtros columna=valor se aplican al leer cada partición
+    carpeta = os.path.join(ruta_archivo() or "", tabla)
+    if not ruta_archivo() or not os.path.isdir(carpeta) or not any(f.endswith(".parquet") and not f.startswith(".") for f in os.listdir(carpeta)):
+        return pd.DataFrame(columns=_TABLAS[tabla])
+    return _leer_parquet(tabla, carpeta, [(c, '==', str(v)) for c, v in filtros.items()])
+
+def grupos_archivados():
+    # [(NombreGrupo, FechaInicio 'AAAA-MM-DD')], del más reciente al más antiguo
+    df = leer_archivo(TAB_GRUPOS).sort_values('FechaInicio', ascending=False)
+    return list(zip(df['NombreGrupo'].astype(str), pd.to_datetime(df['FechaInicio']).dt.strftime("%Y-%m-%d")))
+
+def historial_grupo(grupo, inicio):
+    # Las tablas de un grupo archivado con la forma de cargar_todo(): sirven miembros_grupo, reporte_grupo, pdf_grupo...
+    rutas = {t: _parquet_de(t, grupo, inicio) for t in _TABLAS_ARCHIVO}
+    datos = {t: _leer_parquet(t, r) if os.path.exists(r) else pd.DataFrame(columns=_TABLAS[t]) for t, r in rutas.items()}
+    datos[TAB_USUARIOS] = cargar_df(TAB_USUARIOS, COLS_USUARIOS)
+    return datos
+
+# --- IMPORTACIÓN MASIVA (XLSX/CSV) ---
+# La planilla se recorre fila por fila: cada una se valida contra el calendario del grupo (y contra las filas ya
+# aceptadas del mismo archivo) y queda aceptada o rechazada con su motivo. Lo aceptado se escribe de una sola vez.
+COLS_IMPORTAR = {TAB_PAGOS: ["DNI", "Semana", "Monto"], TAB_MIEMBROS: ["DNI", "Turno", "Tipo"]}
+_ALIAS = {'dni': 'DNI', 'dniusuario': 'DNI', 'documento': 'DNI', 'semana': 'Semana', 'semanapagada': 'Semana',
+          'monto': 'Monto', 'importe': 'Monto', 'turno': 'Turno', 'tipo': 'Tipo'}
+
+def _clave_columna(x):
+    x = unicodedata.normalize('NFKD', str(x or "")).encode('ascii', 'ignore').decode().lower()
+    return _ALIAS.get(re.sub(r'[^a-z]', '', x), str(x).strip())
+
+def leer_planilla(archivo):
+    # Genera (número de fila, {columna: valor}) de un .xlsx o .csv (coma o punto y coma), sin armar la tabla entera
+    datos = io.BytesIO(archivo.getvalue())
+    if getattr(archivo, 'name', '').lower().endswith(('.xlsx', '.xlsm')):
+        filas = openpyxl.load_workbook(datos, read_only=True, data_only=True).active.iter_rows(values_only=True)
+    else:
+        crudo = datos.getvalue()
+        try: texto = crudo.decode('utf-8-sig')
+        except UnicodeDecodeError:  # CSV de Excel en un Windows en español: cp1252; latin-1 acepta cualquier byte
+            try: texto = crudo.decode('cp1252')
+            except UnicodeDecodeError: texto = crudo.decode('latin-1')
+        texto = io.StringIO(texto, newline=''); muestra = texto.read(4096); texto.seek(0)
+        try: dialecto = csv.Sniffer().sniff(muestra, delimiters=";,")
+        except csv.Error: dialecto = csv.excel  # una sola columna: no hay separador que detectar
+        filas = csv.reader(texto, dialecto)
+    enc = [_clave_columna(c) for c in next(filas, [])]
+    for n, fila in enumerate(filas, start=2):
+        if any(v not in (None, "") for v in fila): yield n, dict(zip(enc, fila))
+
+def _texto_celda(v):
+    if isinstance(v, float) and v.is_integer(): v = int(v)  # Excel guarda el DNI como número
+    return "" if v is None else str(v).strip()
+
+def _entero(v):
+    # Entero positivo: 3, 3.0 (Excel), "3" o "Semana 3"; "-3", "2.5" o "0" no valen
+    if isinstance(v, bool): return None
+    m = re.fullmatch(r'(?:semana|turno)?\s*(\d+)', _texto_celda(v), flags=re.I)
+    return int(m.group(1)) if m and int(m.group(1)) > 0 else None
+
+def _numero(v):
+    # Monto: número de Excel o texto como "400", "S/. 215.50" o "215,5" (hasta 2 decimales). Con separador de miles
+    # o punto y coma a la vez ("1,200", "1.200,50") no se sabe qué quiso decir: se rechaza en vez de adivinar
+    if isinstance(v, bool): return None
+    if isinstance(v, (int, float)): return float(v) if np.isfinite(v) else None
+    t = re.sub(r'^(?:S/\.?|PEN)\s*', '', _texto_celda(v), flags=re.I)
+    return float(t.replace(',', '.')) if re.fullmatch(r'\d+(?:[.,]\d{1,2})?', t) else None
+
+def _dni(v, validos):
+    # Excel se come los ceros de adelante: se prueba también completando a 8 dígitos
+    t = _texto_celda(v)
+    return t if t in validos or not t.isdigit() else (t.zfill(8) if t.zfill(8) in validos else t)
+
+def validar_pagos(grupo, filas, datos):
+    # -> (pagos en efectivo listos para agregar, rechazos con su motivo)
+    cols_r = ["Fila", "DNI", "Semana", "Monto", "Motivo"]; ok, malas = [], []
+    cal, res = calcular_libro_grupo(grupo, datos[TAB_MIEMBROS], datos[TAB_GRUPOS], datos[TAB_PAGOS])
+    acumulado = dict(zip(zip(cal['DNI'].astype(str), cal['Semana']), cal.groupby('DNI', sort=False)['Monto'].cumsum()))
+    cubierto = {str(d): a + p for d, a, p in zip(res.index, res['TotAprobado'], res['TotPendiente'])}
+    duracion = int(cal['Semana'].max()) if not cal.empty else 0
+    p = datos[TAB_PAGOS]; p = p[(p['Grupo'] == grupo) & (p['Foto'] == 'Manual')]
+    vistos = set(zip(p['DNI'].astype(str), p['SemanaPagada'].astype(str), p['Monto'].astype(float)))
+    hoy = datetime.now().strftime("%Y-%m-%d")
+    for n, f in filas:
+        dni = _dni(f.get('DNI'), cubierto); semana = _entero(f.get('Semana')); monto = _numero(f.get('Monto'))
+        clave = (dni, f"Semana {semana}", monto)
+        if not dni: motivo = "Falta el DNI"
+        elif dni not in cubierto: motivo = "No es socio de este grupo"
+        elif semana is None or not 1 <= semana <= duracion: motivo = f"Semana fuera del calendario (1 a {duracion})"
+        elif monto is None or monto <= 0: motivo = "Monto inválido"
+        elif clave in vistos: motivo = "Ya registrado (mismo DNI, semana y monto)"
+        elif cubierto[dni] >= acumulado[(dni, semana)]: motivo = "Esa semana ya está cubierta"
+        else: motivo = None
+        if motivo:
+            malas.append({"Fila": n, "DNI": dni, "Semana": _texto_celda(f.get('Semana')), "Monto": _texto_celda(f.get('Monto')), "Motivo": motivo})
+            continue
+        vistos.add(clave); cubierto[dni] += monto
+        ok.append({"Fecha": hoy, "DNI": dni, "Grupo": grupo, "Monto": monto, "Estado": "Aprobado", "Foto": "Manual",
+                   "SemanaPagada": f"Semana {semana}", "ID": nuevo_id_pago()})
+    return pd.DataFrame(ok, columns=COLS_PAGOS), pd.DataFrame(malas, columns=cols_r)
+
+def validar_socios(grupo, filas, datos):
+    # -> (inscripciones listas para agregar, rechazos con su motivo)
+    cols_r = ["Fila", "DNI", "Turno", "Tipo", "Motivo"]; ok, malas = [], []
+    df_g = datos[TAB_GRUPOS]; g = df_g[df_g['NombreGrupo'] == grupo]
+    duracion = int(g['SemanasDuracion'].iloc[0]) if not g.empty and pd.notna(g['SemanasDuracion'].iloc[0]) else 0
+    usuarios = set(datos[TAB_USUARIOS]['DNI'].astype(str)); df_m = datos[TAB_MIEMBROS]
+    ya = set(df_m.loc[df_m['NombreGrupo'] == grupo, 'DNI_Usuario'].astype(str))
+    for n, f in filas:
+        dni = _dni(f.get('DNI'), usuarios); turno = _entero(f.get('Turno'))
+        tipo = {'': 'Completo', 'completo': 'Completo', 'medio': 'Medio', '1/2': 'Medio', '½': 'Medio'}.get(_texto_celda(f.get('Tipo')).lower())
+        if not dni: motivo = "Falta el DNI"
+        elif dni not in usuarios: motivo = "DNI no registrado"
+        elif dni in ya: motivo = "Ya está en el grupo"
+        elif turno is None or not 1 <= turno <= duracion: motivo = f"Turno fuera del calendario (1 a {duracion})"
+        elif tipo is None: motivo = "Tipo debe ser Completo o Medio"
+        else: motivo = None
+        if motivo:
+            malas.append({"Fila": n, "DNI": dni, "Turno": _texto_celda(f.get('Turno')), "Tipo": _texto_celda(f.get('Tipo')), "Motivo": motivo})
+            continue
+        ya.add(dni); ok.append({"NombreGrupo": grupo, "DNI_Usuario": dni, "Turno": turno, "Tipo": tipo})
+    return pd.DataFrame(ok, columns=COLS_MIEMBROS), pd.DataFrame(malas, columns=cols_r)
+
+def importar_filas(hoja, df):
+    # Todo lo aceptado en una sola escritura; si falla se deshace y el error sigue hacia la pantalla
+    try:
+        with medir('importar', hoja=hoja, filas=len(df)), almacen().transaccion(): return _agregar(hoja, df)
+    except Exception: invalidar_tabla(hoja); raise